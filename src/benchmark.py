@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+
+# Cold-start budgets in seconds, measured in a fresh interpreter each time.
+# Importing a module must never load data, models or optional heavy libraries
+# (gradio, faiss, scikit-learn, matplotlib), so these stay well under a second.
+IMPORT_BUDGETS = {
+    "utils": 0.75,
+    "train": 0.75,
+    "main": 0.75,
+    "visualize": 0.75,
+}
+
+# Budget for a scoring worker that only needs the hybrid model
+MODEL_COLD_START_BUDGET = 1.0
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _time_in_subprocess(statement: str, setup: str = "") -> float:
+    """
+    Time a statement in a fresh Python interpreter and return the seconds taken.
+
+    A new process is used for every measurement so that modules cached by
+    earlier imports do not hide the real cold-start cost.
+    """
+    code = (
+        f"import sys, time\n"
+        f"sys.path.insert(0, {SRC_DIR!r})\n"
+        f"{setup}\n"
+        f"start = time.perf_counter()\n"
+        f"{statement}\n"
+        f"print(time.perf_counter() - start)\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True, text=True, check=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+def benchmark_imports(repeat: int = 3) -> dict:
+    """
+    Measure the best-of-N cold import time of every library module.
+    """
+    return {
+        module: min(_time_in_subprocess(f"import {module}") for _ in range(repeat))
+        for module in IMPORT_BUDGETS
+    }
+
+def benchmark_model_cold_start(repeat: int = 3) -> float | None:
+    """
+    Measure importing train.py plus loading the hybrid model from disk.
+
+    Returns None when no trained model is available in the working directory.
+    """
+    if not os.path.exists("hybrid_model.joblib"):
+        return None
+    statement = "from train import load_hybrid_model\nload_hybrid_model()"
+    return min(_time_in_subprocess(statement) for _ in range(repeat))
+
+def run_benchmarks() -> bool:
+    """
+    Run all startup benchmarks, print a report and return whether all budgets hold.
+    """
+    ok = True
+
+    print(f"{'Target':<24}{'Time (s)':>10}{'Budget (s)':>12}")
+    for module, elapsed in benchmark_imports().items():
+        budget = IMPORT_BUDGETS[module]
+        status = "" if elapsed <= budget else "  OVER BUDGET"
+        ok &= elapsed <= budget
+        print(f"{'import ' + module:<24}{elapsed:>10.3f}{budget:>12.2f}{status}")
+
+    cold_start = benchmark_model_cold_start()
+    if cold_start is None:
+        print("model cold start        skipped (hybrid_model.joblib not found)")
+    else:
+        status = "" if cold_start <= MODEL_COLD_START_BUDGET else "  OVER BUDGET"
+        ok &= cold_start <= MODEL_COLD_START_BUDGET
+        print(f"{'model cold start':<24}{cold_start:>10.3f}{MODEL_COLD_START_BUDGET:>12.2f}{status}")
+
+    return ok
+
+if __name__ == "__main__":
+    sys.exit(0 if run_benchmarks() else 1)
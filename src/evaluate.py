@@ -0,0 +1,281 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from utils import DataHandler
+
+# Recommender shared with forked worker processes, see evaluate_recommender()
+_worker_recommender = None
+
+def temporal_split(ratings: pd.DataFrame, test_fraction=0.2, relevance_threshold=4.0):
+    """
+    Split ratings into train and test sets at a single point in time.
+
+    Every rating made after the cutoff timestamp (the `1 - test_fraction`
+    quantile of `timestamp`) is held out, so the model never sees the future.
+    Only users with history on both sides of the cutoff can be evaluated, and
+    their held-out ratings of at least `relevance_threshold` are the relevant
+    items.
+
+    Returns the train ratings and a Series mapping each test user to the array
+    of relevant movie IDs.
+    """
+    cutoff = ratings['timestamp'].quantile(1 - test_fraction)
+    train = ratings[ratings['timestamp'] <= cutoff]
+    test = ratings[(ratings['timestamp'] > cutoff) & (ratings['rating'] >= relevance_threshold)]
+    test = test[test['userId'].isin(train['userId'].unique())]
+
+    relevant = test.groupby('userId')['movieId'].unique()
+    return train, relevant
+
+def build_histories(train: pd.DataFrame, user_ids, max_history=200) -> dict:
+    """
+    Build each user's most recent training ratings as parallel arrays.
+
+    Returns a dict mapping each user to a (movie_ids, ratings, timestamps)
+    tuple holding at most `max_history` of their latest ratings.
+    """
+    recent = (
+        train[train['userId'].isin(user_ids)]
+        .sort_values('timestamp')
+        .groupby('userId')
+        .tail(max_history)
+    )
+    return {
+        user_id: (
+            group['movieId'].to_numpy(),
+            group['rating'].to_numpy(),
+            group['timestamp'].to_numpy(),
+        )
+        for user_id, group in recent.groupby('userId')
+    }
+
+def hybrid_recommender(model, content_weight=0.4, half_life_days=None, **options):
+    """
+    Wrap a HybridModel as a recommender returning movie IDs.
+
+    The returned callable takes a (movie_ids, ratings, timestamps) history and
+    `k` and returns the recommended movie IDs in rank order. Further `options`
+    (candidate limits, exhaustive scoring) are passed to the model.
+    """
+    # Build the per-model caches once here instead of in every forked worker
+    model.warm_up()
+
+    def recommend(history: tuple, k: int) -> list:
+        movie_ids, ratings, timestamps = history
+        recs = model.recommend_from_history(
+            movie_ids, ratings, timestamps, content_weight=content_weight,
+            top_n=k, half_life_days=half_life_days, **options,
+        )
+        return recs['movieId'].astype(int).tolist()
+
+    return recommend
+
+def _recommend_batch(batch):
+    """
+    Run the shared recommender over a batch of user histories.
+
+    Returns the recommended movie IDs and latency in seconds for every user.
+    The recommenders print debug output, which is discarded here.
+    """
+    histories, k = batch
+    results = []
+    for history in histories:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            recs = _worker_recommender(history, k)
+            elapsed = time.perf_counter() - start
+        results.append((recs[:k], elapsed))
+    return results
+
+def ranking_metrics(recommended: np.ndarray, relevant: list, k: int) -> dict:
+    """
+    Compute ranking metrics for all users at once.
+
+    `recommended` is an (n_users, k) array of movie IDs padded with -1, and
+    `relevant` holds an array of relevant movie IDs per user. Returns the
+    per-user precision@k, recall@k, NDCG@k and AP@k arrays.
+    """
+    n_users = recommended.shape[0]
+    n_relevant = np.array([len(items) for items in relevant])
+
+    # Membership test for every (user, rank) pair in one vectorized lookup,
+    # by encoding (user row, movie ID) pairs as single integers
+    rows = np.arange(n_users)
+    relevant_ids = np.concatenate([np.asarray(items, dtype=np.int64) for items in relevant] + [np.empty(0, dtype=np.int64)])
+    offset = max(int(recommended.max(initial=0)), int(relevant_ids.max(initial=0))) + 1
+    relevant_keys = np.repeat(rows, n_relevant) * offset + relevant_ids
+    recommended_keys = rows[:, None] * offset + recommended
+    hits = np.isin(recommended_keys, relevant_keys) & (recommended >= 0)
+
+    hit_counts = hits.sum(axis=1)
+    precision = hit_counts / k
+    recall = np.divide(hit_counts, n_relevant, out=np.zeros(n_users), where=n_relevant > 0)
+
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = (hits * discounts).sum(axis=1)
+    ideal_discounts = np.concatenate([[0.0], np.cumsum(discounts)])
+    idcg = ideal_discounts[np.minimum(n_relevant, k)]
+    ndcg = np.divide(dcg, idcg, out=np.zeros(n_users), where=idcg > 0)
+
+    precision_at_rank = np.cumsum(hits, axis=1) / np.arange(1, k + 1)
+    denominator = np.minimum(n_relevant, k)
+    average_precision = np.divide(
+        (precision_at_rank * hits).sum(axis=1), denominator,
+        out=np.zeros(n_users), where=denominator > 0,
+    )
+
+    return {
+        'precision': precision,
+        'recall': recall,
+        'ndcg': ndcg,
+        'average_precision': average_precision,
+    }
+
+def evaluate_recommender(recommend, histories: dict, relevant: pd.Series, catalog_size: int,
+                         k=10, workers=1, batch_size=32) -> dict:
+    """
+    Evaluate a recommender on held-out users.
+
+    Recommendations are generated in batches of users, spread over `workers`
+    forked processes that share the recommender copy-on-write. Returns the mean
+    ranking metrics, catalog coverage (the share of the `catalog_size` movies
+    recommended to any user) and latency percentiles.
+    """
+    global _worker_recommender
+    _worker_recommender = recommend
+
+    user_ids = [user_id for user_id in relevant.index if user_id in histories]
+    batches = [
+        ([histories[user_id] for user_id in user_ids[i:i + batch_size]], k)
+        for i in range(0, len(user_ids), batch_size)
+    ]
+
+    if workers > 1:
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            results = [result for batch in executor.map(_recommend_batch, batches) for result in batch]
+    else:
+        results = [result for batch in map(_recommend_batch, batches) for result in batch]
+
+    recommended = np.full((len(user_ids), k), -1, dtype=np.int64)
+    for row, (recs, _) in enumerate(results):
+        recommended[row, :len(recs)] = recs
+    latencies = np.array([elapsed for _, elapsed in results])
+
+    metrics = ranking_metrics(recommended, [relevant[user_id] for user_id in user_ids], k)
+    recommended_items = np.unique(recommended[recommended >= 0])
+
+    return {
+        'users_evaluated': len(user_ids),
+        f'precision@{k}': float(metrics['precision'].mean()) if user_ids else 0.0,
+        f'recall@{k}': float(metrics['recall'].mean()) if user_ids else 0.0,
+        f'ndcg@{k}': float(metrics['ndcg'].mean()) if user_ids else 0.0,
+        f'map@{k}': float(metrics['average_precision'].mean()) if user_ids else 0.0,
+        'coverage': len(recommended_items) / catalog_size if catalog_size else 0.0,
+        'latency_ms': {
+            'mean': float(latencies.mean() * 1000) if user_ids else 0.0,
+            'p50': float(np.percentile(latencies, 50) * 1000) if user_ids else 0.0,
+            'p95': float(np.percentile(latencies, 95) * 1000) if user_ids else 0.0,
+            'p99': float(np.percentile(latencies, 99) * 1000) if user_ids else 0.0,
+        },
+    }
+
+def run_evaluation(k=10, test_fraction=0.2, max_users=1000, max_history=200, content_weight=0.4,
+                   half_life_days=None, candidate_limits=None, exhaustive=False, workers=1,
+                   output="evaluation_report.json", seed=42) -> dict:
+    """
+    Train a hybrid model on a temporal split and evaluate it on the held-out ratings.
+
+    The model is trained on ratings before the cutoff, downsampled like in
+    `train_model`. The most active users and most rated movies are picked from
+    the training ratings only, so held-out activity does not leak into the
+    training set. The report, including the settings used, is written to
+    `output` as JSON so runs with different settings can be compared.
+    """
+    from train import HybridModel, downsample_ratings
+
+    data_handler = DataHandler("data/")
+    movies, ratings = data_handler.load_data("movies.csv", "ratings.csv")
+    movies = data_handler.preprocess_movies(movies)
+
+    train, relevant = temporal_split(ratings, test_fraction)
+    train = downsample_ratings(train)
+    relevant = relevant[relevant.index.isin(train['userId'].unique())]
+    if len(relevant) > max_users:
+        relevant = relevant.sample(max_users, random_state=seed)
+
+    print(f"Training on {len(train)} ratings, evaluating {len(relevant)} users...")
+    with contextlib.redirect_stdout(io.StringIO()):
+        model = HybridModel(movies, train)
+    histories = build_histories(train, relevant.index, max_history)
+
+    report = {
+        'settings': {
+            'k': k,
+            'test_fraction': test_fraction,
+            'max_users': max_users,
+            'max_history': max_history,
+            'content_weight': content_weight,
+            'half_life_days': half_life_days,
+            'candidate_limits': candidate_limits,
+            'exhaustive': exhaustive,
+            'workers': workers,
+            'seed': seed,
+        },
+        'metrics': evaluate_recommender(
+            hybrid_recommender(
+                model, content_weight, half_life_days,
+                candidate_limits=candidate_limits, exhaustive=exhaustive,
+            ),
+            histories, relevant,
+            # Any catalog movie can be recommended, not only those in the rating matrix
+            catalog_size=len(model.movies), k=k, workers=workers,
+        ),
+    }
+
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline evaluation of the hybrid recommender")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--test-fraction", type=float, default=0.2)
+    parser.add_argument("--max-users", type=int, default=1000)
+    parser.add_argument("--max-history", type=int, default=200)
+    parser.add_argument("--content-weight", type=float, default=0.4)
+    parser.add_argument("--half-life-days", type=float, default=None)
+    parser.add_argument("--candidates-collaborative", type=int, default=None)
+    parser.add_argument("--candidates-content", type=int, default=None)
+    parser.add_argument("--candidates-popular", type=int, default=None)
+    parser.add_argument("--exhaustive", action="store_true", help="score the whole catalog")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--output", default="evaluation_report.json")
+    args = parser.parse_args()
+
+    run_evaluation(
+        k=args.k,
+        test_fraction=args.test_fraction,
+        max_users=args.max_users,
+        max_history=args.max_history,
+        content_weight=args.content_weight,
+        half_life_days=args.half_life_days,
+        candidate_limits={
+            source: limit for source, limit in (
+                ('collaborative', args.candidates_collaborative),
+                ('content', args.candidates_content),
+                ('popular', args.candidates_popular),
+            ) if limit is not None
+        },
+        exhaustive=args.exhaustive,
+        workers=args.workers,
+        output=args.output,
+    )
@@ -1,23 +1,133 @@
-import gradio as gr
-import pandas as pd
+import threading
+import time
+from typing import TYPE_CHECKING
 from utils import DataHandler, ContentModel
+from request_profiler import profile_call, stage
+from model_registry import MODELS_ENV, ModelRegistry, parse_model_spec, read_model_spec, registry_from_spec
 
-# Initialize components
+if TYPE_CHECKING:
+    import gradio as gr
+    import pandas as pd
+
+# Components are loaded lazily by the init_*() functions so that importing
+# this module does not read the CSVs or unpickle the hybrid model.
 data_handler = DataHandler("data/")
-movies, _ = data_handler.load_data("movies.csv", "ratings.csv")
-movies = data_handler.preprocess_movies(movies)
+movies = None
+content_model = None  # content-based fallback, see init_content_model()
+hybrid_model = None
+model_registry = None  # set instead of hybrid_model when RECOMMENDER_MODELS is configured
+model_loaded = None  # None until a load has been attempted
+_reload_lock = threading.Lock()
+
+def init_movies() -> 'pd.DataFrame':
+    """
+    Load and preprocess the movie metadata on first use.
+
+    Only the content-based fallback needs the movies DataFrame, so workers that
+    score with the hybrid model never pay for reading and preprocessing it.
+    """
+    global movies
+    if movies is None:
+        movies = data_handler.preprocess_movies(data_handler.load_movies("movies.csv"))
+    return movies
+
+def init_content_model() -> ContentModel:
+    """
+    Build the content-based fallback model once, on first use.
+
+    Building it loads the similarity matrix and fits the TF-IDF vectorizer,
+    which is too slow to repeat for every request.
+    """
+    global content_model
+    if content_model is None:
+        content_model = ContentModel(init_movies())
+    return content_model
+
+def init_model() -> bool:
+    """
+    Load the pre-trained hybrid model on first use.
+
+    Returns whether the hybrid model is available. A failed load is remembered
+    so it is not retried on every request. If RECOMMENDER_MODELS lists several
+    model versions (see `model_registry.parse_model_spec`), all of them are
+    loaded into `model_registry` and users are routed between them; a
+    malformed list raises instead of falling back to the content model.
+    """
+    global hybrid_model, model_registry, model_loaded
+    if model_loaded is None:
+        spec = read_model_spec()
+        if spec:
+            # A malformed spec is a configuration error, not a missing model
+            parse_model_spec(spec)
+        try:
+            if spec:
+                model_registry = registry_from_spec(spec)
+            else:
+                # Import the model class and loading function
+                from train import load_hybrid_model
+                hybrid_model = load_hybrid_model()
+            model_loaded = True
+            print("✅ Hybrid model loaded successfully")
+        except Exception as e:
+            print(f"❌ Failed to load hybrid model: {e}")
+            model_loaded = False
+    return model_loaded
 
-try:
-    # Import the model class and loading function
-    from train import load_hybrid_model
-    hybrid_model = load_hybrid_model()
-    model_loaded = True
-    print("✅ Hybrid model loaded successfully")
-except Exception as e:
-    print(f"❌ Failed to load hybrid model: {e}")
-    model_loaded = False
+def reload_models(spec: str | None = None) -> dict:
+    """
+    Deploy model versions while serving, without a restart.
+
+    `spec` lists the versions and traffic weights (see
+    `model_registry.parse_model_spec`) and defaults to RECOMMENDER_MODELS,
+    re-read from its file if it names one. New or changed model files are
+    loaded and warmed in the background while the current versions keep
+    serving, and traffic moves over only once all of them are ready (see
+    `ModelRegistry.deploy`). If a load fails, the served versions stay
+    unchanged and the error is raised. Returns the new model metrics.
+    """
+    global hybrid_model, model_registry, model_loaded
+    spec = spec or read_model_spec()
+    if not spec:
+        raise ValueError(f"No model versions to deploy, set {MODELS_ENV}")
+    versions = parse_model_spec(spec)
+
+    with _reload_lock:
+        registry = model_registry if model_registry is not None else ModelRegistry()
+        registry.deploy(versions)
+        # The registry replaces a single hybrid_model from here on; it is set
+        # before the old model is dropped, see _recommend_movies
+        model_registry, model_loaded = registry, True
+        hybrid_model = None
+    print(f"✅ Serving model versions {sorted(registry.versions)}")
+    return model_metrics()
+
+def install_reload_handler(reload=reload_models):
+    """
+    Call `reload` (by default `reload_models`) whenever the process gets SIGHUP.
+
+    With RECOMMENDER_MODELS pointing to a spec file, editing the file and
+    sending SIGHUP rolls out new model versions or traffic splits. The reload
+    runs in a background thread so requests keep being served; failures are
+    logged and leave the served versions unchanged.
+    """
+    import signal
+
+    def run():
+        try:
+            reload()
+        except Exception as e:
+            print(f"❌ Model reload failed: {e}")
+
+    signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=run, daemon=True).start())
+
+def init_components():
+    """
+    Eagerly load everything the Gradio app needs before serving requests.
+    """
+    if not init_model():
+        init_content_model()
 
-def format_recommendations_markdown(df: pd.DataFrame) -> str:
+def format_recommendations_markdown(df: 'pd.DataFrame') -> str:
     """
     Format movie recommendations as a Markdown table.
 
@@ -48,7 +158,7 @@ def format_recommendations_markdown(df: pd.DataFrame) -> str:
         lines.append(f"| {title} | {genres} |")
     return '\n'.join(lines)
 
-def format_recommendations(df: pd.DataFrame) -> str:
+def format_recommendations(df: 'pd.DataFrame') -> str:
     """
     Format movie recommendations as a user-friendly text display.
 
@@ -80,19 +190,54 @@ def format_recommendations(df: pd.DataFrame) -> str:
         lines.append(f"🎬 {title}\n   📂 Genres: {genres}")
     return '\n\n'.join(lines)
 
-def recommend_movies(user_input: str):
+def model_metrics() -> dict:
+    """
+    Return per-version latency and memory metrics when serving several model versions.
+    """
+    return model_registry.metrics() if model_registry is not None else {}
+
+def available_genres() -> list:
+    """
+    Return the genres that can be used as recommendation filters.
+
+    Hybrid models already list them in their filter index; only the
+    content-based fallback collects them from the movies.
+    """
+    registry, model = model_registry, hybrid_model
+    if model_loaded and registry is not None:
+        model = next(iter(registry.versions.values())).model
+    if model_loaded:
+        return list(model._lookups()['filter_index'].genres)
+    catalog = init_movies()
+    return sorted(set(genre for sublist in catalog['genres'] if isinstance(sublist, list) for genre in sublist))
+
+def recommend_movies(user_input: str, profile=False, user_id=None, genres=None,
+                     exclude_genres=None, year_range=None):
     """
     Generate movie recommendations based on user input.
 
     This is the main function that powers the movie recommendation system.
     It parses user input, creates a rating profile, and generates recommendations
     using either the hybrid model (if available) or content-based filtering.
+    Set `profile` (or the RECOMMENDER_PROFILE environment variable) to capture
+    a profile of the request, see `request_profiler`. When several model
+    versions are served, `user_id` (or the input itself if not given) picks the
+    version. `genres`, `exclude_genres` and `year_range` restrict the
+    recommendations, see `utils.FilterIndex.compile_mask`.
+    """
+    filters = {'genres': genres, 'exclude_genres': exclude_genres, 'year_range': year_range}
+    return profile_call(_recommend_movies, user_input, user_id, filters, request_input=user_input, force=profile)
+
+def _recommend_movies(user_input: str, user_id=None, filters=None):
+    """
+    Generate recommendations for `recommend_movies`, timing each stage.
     """
     print(f"\n🔍 DEBUG: User input: '{user_input}'")
 
     # Parse input: "Movie Title, Movie Title, Movie Title"
-    user_ratings = {}
-    movie_titles = [title.strip() for title in user_input.split(',') if title.strip()]
+    with stage("parse"):
+        user_ratings = {}
+        movie_titles = [title.strip() for title in user_input.split(',') if title.strip()]
 
     if not movie_titles:
         return "Please enter at least one movie title"
@@ -104,18 +249,39 @@ def recommend_movies(user_input: str):
         user_ratings[title] = 4.0
 
     print(f"🔍 DEBUG: User ratings dict: {user_ratings}")
-    print(f"🔍 DEBUG: Model loaded: {model_loaded}")
+    with stage("load_model"):
+        print(f"🔍 DEBUG: Model loaded: {init_model()}")
 
-    # Use hybrid model if available, else content-based
-    if model_loaded:
+    # Use hybrid model if available, else content-based. The globals are read
+    # once since reload_models() may replace them while this request runs, and
+    # hybrid_model first since a reload sets model_registry before clearing it.
+    model = hybrid_model
+    registry = model_registry
+    if model_loaded and registry is not None:
+        version = registry.route(user_id if user_id is not None else user_input)
+        print(f"🔍 DEBUG: Using hybrid model version '{version.name}'")
+        start = time.perf_counter()
+        try:
+            with stage("recommend"):
+                recommendations = version.model.hybrid_recommend(user_ratings, **(filters or {}))
+        except Exception:
+            registry.record(version, time.perf_counter() - start, error=True)
+            raise
+        registry.record(version, time.perf_counter() - start)
+        print(f"🔍 DEBUG: Hybrid recommendations shape: {recommendations.shape}")
+        print(f"🔍 DEBUG: Hybrid recommendations:\n{recommendations}")
+    elif model_loaded:
         print("🔍 DEBUG: Using hybrid model")
-        recommendations = hybrid_model.hybrid_recommend(user_ratings)
+        with stage("recommend"):
+            recommendations = model.hybrid_recommend(user_ratings, **(filters or {}))
         print(f"🔍 DEBUG: Hybrid recommendations shape: {recommendations.shape}")
         print(f"🔍 DEBUG: Hybrid recommendations:\n{recommendations}")
     else:
         print("🔍 DEBUG: Using content-based model")
-        content_model = ContentModel(movies)
-        recommendations = content_model.content_recommendations(user_ratings)
+        with stage("content_model_build"):
+            fallback = init_content_model()
+        with stage("recommend"):
+            recommendations = fallback.content_recommendations(user_ratings, **(filters or {}))
         print(f"🔍 DEBUG: Content recommendations shape: {recommendations.shape}")
         print(f"🔍 DEBUG: Content recommendations:\n{recommendations}")
 
@@ -123,7 +289,8 @@ def recommend_movies(user_input: str):
     if recommendations.empty:
         return "No recommendations found. Please check if movie titles are correct."
 
-    result = format_recommendations(recommendations)
+    with stage("format"):
+        result = format_recommendations(recommendations)
     print(f"🔍 DEBUG: Final formatted result:\n{result}")
     return result
 
@@ -150,40 +317,87 @@ def test_recommendations():
         result = recommend_movies(test_input)
         print(f"RESULT:\n{result}")
 
-# Gradio interface
-with gr.Blocks() as demo:
-    # upload TBC-Logo
-    gr.Image(
-        value="docs/assets/tbc-logo.png", 
-        interactive=False, 
-        show_label=False, 
-        height=120, 
-        width=120,
-        show_download_button=False,
-        show_fullscreen_button=False,
-    )
-
-    # model interface
-    gr.Interface(
-        fn=recommend_movies,
-        inputs=gr.Textbox(
-            label="Movies You Like", 
-            placeholder="The Shawshank Redemption, The Godfather, Inception",
-            lines=3
-        ),
-        outputs=gr.Textbox(label="Recommended Movies"),
-        concurrency_limit=1,
-        title="Personal Movie Recommender",
-        description='<div align="center">Enter movies you like separated by commas (we\'ll assume you rate them highly!</div>',
-        examples=[
-            ["The Dark Knight, Inception, Interstellar"],
-            ["Toy Story, Finding Nemo, Shrek"],
-            ["The Shawshank Redemption, Forrest Gump, Pulp Fiction"]
-        ]
-    )
+def build_demo(fn=recommend_movies, concurrency_limit=1) -> 'gr.Blocks':
+    """
+    Build the Gradio interface.
+
+    `fn` handles each request and receives the Gradio session as `user_id`;
+    the multi-process server passes a function that routes requests to its
+    worker pool. Gradio is imported here rather than at module level since it
+    is by far the slowest import and is not needed by anything but the web app.
+    """
+    import gradio as gr
+
+    def handle(user_input: str, genres: list, exclude_genres: list, year_from, year_to, request: gr.Request):
+        year_range = None if year_from is None and year_to is None else (year_from, year_to)
+        return fn(
+            user_input,
+            user_id=request.session_hash if request else None,
+            genres=genres or None,
+            exclude_genres=exclude_genres or None,
+            year_range=year_range,
+        )
+
+    genre_choices = available_genres()
+
+    with gr.Blocks() as demo:
+        # upload TBC-Logo
+        gr.Image(
+            value="docs/assets/tbc-logo.png", 
+            interactive=False, 
+            show_label=False, 
+            height=120, 
+            width=120,
+            show_download_button=False,
+            show_fullscreen_button=False,
+        )
+
+        # model interface
+        gr.Interface(
+            fn=handle,
+            inputs=[
+                gr.Textbox(
+                    label="Movies You Like", 
+                    placeholder="The Shawshank Redemption, The Godfather, Inception",
+                    lines=3
+                ),
+                gr.Dropdown(genre_choices, multiselect=True, label="Only These Genres (optional)"),
+                gr.Dropdown(genre_choices, multiselect=True, label="Exclude Genres (optional)"),
+                gr.Number(label="Released From Year (optional)", precision=0),
+                gr.Number(label="Released Until Year (optional)", precision=0),
+            ],
+            outputs=gr.Textbox(label="Recommended Movies"),
+            concurrency_limit=concurrency_limit,
+            title="Personal Movie Recommender",
+            description='<div align="center">Enter movies you like separated by commas (we\'ll assume you rate them highly!</div>',
+            examples=[
+                ["The Dark Knight, Inception, Interstellar", [], [], None, None],
+                ["Toy Story, Finding Nemo, Shrek", [], [], None, None],
+                ["The Shawshank Redemption, Forrest Gump, Pulp Fiction", [], [], None, None],
+                ["Inception", ["Sci-Fi"], [], 2000, None]
+            ]
+        )
+
+        # per-version metrics when several model versions are served
+        if model_registry is not None:
+            with gr.Accordion("Model versions", open=False):
+                metrics = gr.JSON(value=model_metrics)
+                gr.Button("Refresh").click(fn=model_metrics, outputs=metrics)
+
+    return demo
+
+def __getattr__(name: str):
+    """Build `demo` on first access so `gradio main.py` reload mode still finds it."""
+    if name == "demo":
+        global demo
+        demo = build_demo()
+        return demo
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
     """Main execution block for the Gradio movie recommendation application"""
+    init_components()
+    install_reload_handler()
     # Then launch Gradio
     print("\nLaunching Gradio interface...")
-    demo.launch(share=True)
+    build_demo().launch(share=True)
@@ -0,0 +1,388 @@
+import collections
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+# Environment variable listing the model versions to serve (or naming a file
+# that lists them, as '@path'), see read_model_spec()
+MODELS_ENV = "RECOMMENDER_MODELS"
+
+# Number of latency samples kept per version for the metrics
+LATENCY_WINDOW = 1000
+
+def parse_model_spec(spec: str) -> list:
+    """
+    Parse a model version spec into (name, path, weight) tuples.
+
+    The spec is a list of `name=path:weight` entries separated by commas or
+    newlines, e.g.
+    `current=hybrid_model.joblib:90,candidate=hybrid_model_v2.joblib:10`.
+    The weight is optional and defaults to 1, so a single `name=path` entry
+    receives all traffic; a weight of 0 loads a version without routing any
+    traffic to it.
+    """
+    versions = []
+    for entry in spec.replace('\n', ',').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, target = entry.partition('=')
+        path, _, weight = target.rpartition(':') if ':' in target else (target, '', '1')
+        if not name or not path:
+            raise ValueError(f"Invalid model spec entry: {entry!r}")
+        try:
+            weight = float(weight or 1)
+        except ValueError:
+            raise ValueError(f"Invalid weight in model spec entry: {entry!r}") from None
+        versions.append((name.strip(), path.strip(), weight))
+    if not any(weight > 0 for _, _, weight in versions):
+        raise ValueError(f"At least one model version must receive traffic: {spec!r}")
+    return versions
+
+def read_model_spec() -> str | None:
+    """
+    Return the model spec configured in RECOMMENDER_MODELS, if any.
+
+    A value starting with '@' names a file holding the spec. The file is read
+    again on every call, so the served versions can be changed while serving
+    (see `main.reload_models`).
+    """
+    spec = os.environ.get(MODELS_ENV)
+    if spec and spec.startswith('@'):
+        with open(spec[1:]) as f:
+            spec = f.read()
+    return spec
+
+def _current_rss() -> int | None:
+    """
+    Return the resident memory of this process in bytes, if psutil is available.
+    """
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+class ModelVersion:
+    """
+    A loaded model version together with its serving metrics.
+    """
+
+    def __init__(self, name: str, path: str, model, load_seconds: float, rss_delta: int | None):
+        """
+        Wrap a loaded and warmed model.
+        """
+        self.name = name
+        self.path = path
+        self.file_mtime = os.path.getmtime(path)
+        self.model = model
+        self.loaded_at = time.time()
+        self.load_seconds = load_seconds
+        self.rss_delta = rss_delta
+        self.model_bytes = model.memory_usage()
+        self.requests = 0
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def is_current(self, path: str) -> bool:
+        """
+        Return whether this version was loaded from `path` as it is on disk now.
+        """
+        return path == self.path and os.path.exists(path) and os.path.getmtime(path) == self.file_mtime
+
+    def record(self, seconds: float, error=False):
+        """
+        Record the latency of one request served by this version.
+        """
+        with self._lock:
+            self.requests += 1
+            self.errors += error
+            self.latencies.append(seconds)
+
+    def metrics(self) -> dict:
+        """
+        Return request, latency and memory metrics for this version.
+        """
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+            requests, errors = self.requests, self.errors
+
+        latency = {}
+        if len(latencies):
+            latency = {
+                'mean': float(latencies.mean()),
+                'p50': float(np.percentile(latencies, 50)),
+                'p95': float(np.percentile(latencies, 95)),
+                'p99': float(np.percentile(latencies, 99)),
+            }
+        return {
+            'path': self.path,
+            'loaded_at': self.loaded_at,
+            'load_seconds': self.load_seconds,
+            'requests': requests,
+            'errors': errors,
+            'latency_ms': latency,
+            'model_bytes': self.model_bytes,
+            'rss_delta_bytes': self.rss_delta,
+        }
+
+class ModelRegistry:
+    """
+    Keeps several hybrid model versions resident and routes users between them.
+
+    Users are assigned to versions by a deterministic hash of their ID, so a
+    user keeps seeing the same version for a given traffic split. New versions
+    are loaded and warmed (optionally in a background thread) before they are
+    added, and traffic splits are replaced in a single assignment, so requests
+    never see a half-loaded model or a partially updated split. `deploy`
+    combines both to switch versions while serving.
+
+    With the pre-fork server (serve.py) the workers are forked from the
+    parent's registry, so they are restarted after a deploy. The workers
+    forward their request records to the parent (see `forward_records`),
+    whose registry reports the metrics.
+    """
+
+    def __init__(self):
+        """
+        Create an empty registry.
+        """
+        self.versions = {}
+        self.weights = {}
+        self.routes = ()  # ((version, cumulative upper bound in [0, 1]), ...)
+        self.load_errors = {}  # name -> error of the last failed load
+        self._lock = threading.Lock()
+        self._forwarded = None  # records kept for take_records(), see forward_records()
+
+    def load(self, name: str, path: str, background=False):
+        """
+        Load, warm and register a model version.
+
+        The version only becomes routable once it is fully loaded and warmed;
+        if it replaces a version of the same name, its traffic moves over in
+        one step. With `background=True` loading happens in a daemon thread
+        and a Future is returned, whose result is the version or the load
+        error, so callers can wait for it before cutting traffic over. Failed
+        loads are also kept in `load_errors`.
+        """
+        if background:
+            return self._load_in_background(name, path, register=True)
+        return self._register(self._load(name, path))
+
+    def _load_in_background(self, name: str, path: str, register: bool) -> Future:
+        """
+        Load a version in a daemon thread and return a Future for it.
+        """
+        future = Future()
+
+        def run():
+            try:
+                version = self._load(name, path)
+                future.set_result(self._register(version) if register else version)
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    def _load(self, name: str, path: str) -> ModelVersion:
+        """
+        Load and warm a model version without registering it.
+        """
+        from train import load_hybrid_model
+
+        try:
+            rss_before = _current_rss()
+            start = time.perf_counter()
+            model = load_hybrid_model(path).warm_up()
+
+            # Run one recommendation so the first real request does not pay for
+            # faulting in the index and similarity pages
+            movie_ids = model.ratings['movieId'].head(1).to_numpy()
+            model.recommend_from_history(movie_ids, np.full(len(movie_ids), 4.0))
+
+            load_seconds = time.perf_counter() - start
+            rss_after = _current_rss()
+            rss_delta = rss_after - rss_before if rss_before is not None else None
+        except Exception as e:
+            with self._lock:
+                self.load_errors = {**self.load_errors, name: f"{path}: {type(e).__name__}: {e}"}
+            print(f"❌ Failed to load model version {name!r} from {path}: {e}")
+            raise
+
+        with self._lock:
+            self.load_errors = {key: value for key, value in self.load_errors.items() if key != name}
+        return ModelVersion(name, path, model, load_seconds, rss_delta)
+
+    def _register(self, version: ModelVersion) -> ModelVersion:
+        """
+        Make a loaded version available, replacing a version of the same name.
+        """
+        with self._lock:
+            self.versions = {**self.versions, version.name: version}
+        if version.name in self.weights:
+            self.set_routes(self.weights)
+        return version
+
+    def deploy(self, versions: list):
+        """
+        Switch to a new set of versions and traffic split while serving.
+
+        `versions` holds (name, path, weight) tuples as returned by
+        `parse_model_spec`. Versions that are not loaded yet, or whose model
+        file changed since they were loaded, are loaded and warmed in parallel
+        background threads while the current versions keep serving. Only once
+        all of them are ready are they registered and the traffic split
+        replaced; versions left out are then unloaded. If any load fails, the
+        registry is left unchanged and the error is raised.
+        """
+        pending = [
+            self._load_in_background(name, path, register=False)
+            for name, path, _ in versions
+            if name not in self.versions or not self.versions[name].is_current(path)
+        ]
+        loaded = [future.result() for future in pending]
+
+        weights = {name: weight for name, _, weight in versions}
+        with self._lock:
+            self.versions = {**self.versions, **{version.name: version for version in loaded}}
+            self.load_errors = {name: error for name, error in self.load_errors.items() if name in weights}
+        self.set_routes(weights)
+        for name in list(self.versions):
+            if name not in weights:
+                self.unload(name)
+        return loaded
+
+    def unload(self, name: str):
+        """
+        Remove a version that no longer receives traffic.
+        """
+        if any(version.name == name for version, _ in self.routes):
+            raise ValueError(f"Model version {name!r} still receives traffic")
+        with self._lock:
+            self.versions = {key: value for key, value in self.versions.items() if key != name}
+
+    def set_routes(self, weights: dict):
+        """
+        Atomically replace the traffic split.
+
+        `weights` maps version names to relative weights; every version with
+        a positive weight must already be loaded.
+        """
+        positive = {name: weight for name, weight in weights.items() if weight > 0}
+        missing = [name for name in positive if name not in self.versions]
+        if missing:
+            raise ValueError(f"Model versions not loaded: {missing}")
+        if not positive:
+            raise ValueError("At least one model version must receive traffic")
+
+        versions = self.versions
+        total = sum(positive.values())
+        routes, bound = [], 0.0
+        for name, weight in sorted(positive.items()):
+            bound += weight / total
+            routes.append((versions[name], bound))
+        routes[-1] = (routes[-1][0], 1.0)
+        # Routes hold the versions themselves, so unloading a version never
+        # breaks a request that read the previous split
+        self.weights = dict(weights)
+        self.routes = tuple(routes)
+
+    def promote(self, name: str):
+        """
+        Send all traffic to a single loaded version.
+        """
+        self.set_routes({name: 1})
+
+    def route(self, user_key) -> ModelVersion:
+        """
+        Return the version serving `user_key`, chosen by a stable hash.
+        """
+        routes = self.routes
+        if not routes:
+            raise RuntimeError("No model version receives traffic")
+        digest = hashlib.blake2b(str(user_key).encode(), digest_size=8).digest()
+        bucket = int.from_bytes(digest, 'big') / 2 ** 64
+        for version, bound in routes:
+            if bucket < bound:
+                return version
+        return routes[-1][0]
+
+    def record(self, version: ModelVersion, seconds: float, error=False):
+        """
+        Record the latency of one request served by `version`.
+        """
+        version.record(seconds, error)
+        if self._forwarded is not None:
+            self._forwarded.append((version.name, seconds, error))
+
+    def after_fork(self):
+        """
+        Give this registry and its versions fresh locks in a forked process.
+
+        A fork copies locks in whatever state they are in, so a lock held by
+        another thread of the parent (e.g. while merging worker records) would
+        stay locked forever in the child.
+        """
+        self._lock = threading.Lock()
+        for version in {*self.versions.values(), *(version for version, _ in self.routes)}:
+            version._lock = threading.Lock()
+
+    def forward_records(self):
+        """
+        Also keep every record for `take_records`.
+
+        Used in worker processes, whose records are sent back to the parent
+        process with each response and merged there with `merge_records`.
+        """
+        self._forwarded = []
+
+    def take_records(self) -> list:
+        """
+        Return and clear the (name, seconds, error) records kept since the last call.
+        """
+        records = self._forwarded or []
+        if self._forwarded is not None:
+            self._forwarded = []
+        return records
+
+    def merge_records(self, records: list):
+        """
+        Add records taken from another process's registry to this one.
+        """
+        for name, seconds, error in records:
+            version = self.versions.get(name)
+            if version is not None:
+                version.record(seconds, error)
+
+    def metrics(self) -> dict:
+        """
+        Return the serving metrics and traffic share of every loaded version.
+        """
+        shares, previous = {}, 0.0
+        for version, bound in self.routes:
+            shares[version.name] = bound - previous
+            previous = bound
+        metrics = {
+            name: {**version.metrics(), 'traffic_share': shares.get(name, 0.0)}
+            for name, version in self.versions.items()
+        }
+        for name, error in self.load_errors.items():
+            metrics.setdefault(name, {'traffic_share': 0.0})['load_error'] = error
+        return metrics
+
+def registry_from_spec(spec: str) -> ModelRegistry:
+    """
+    Build a registry from a model spec, loading every version up front.
+    """
+    registry = ModelRegistry()
+    versions = parse_model_spec(spec)
+    for name, path, _ in versions:
+        registry.load(name, path)
+    registry.set_routes({name: weight for name, _, weight in versions})
+    return registry
@@ -0,0 +1,169 @@
+import argparse
+import contextlib
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import threading
+import time
+from pathlib import Path
+
+# Set to 1 to profile requests, optionally only 1 in every SAMPLE_ENV requests
+PROFILE_ENV = "RECOMMENDER_PROFILE"
+SAMPLE_ENV = "RECOMMENDER_PROFILE_SAMPLE"
+DIR_ENV = "RECOMMENDER_PROFILE_DIR"
+DEFAULT_PROFILE_DIR = "profiles"
+
+_state = threading.local()
+_request_counter = itertools.count(1)
+_sample_rate = None  # parsed from SAMPLE_ENV on first use, see sample_rate()
+
+def sample_rate() -> int:
+    """
+    Return N from SAMPLE_ENV, profiling 1 in every N requests.
+
+    Parsed once. An invalid value falls back to profiling every request with
+    a warning, rather than failing the requests it was meant to sample.
+    """
+    global _sample_rate
+    if _sample_rate is None:
+        value = os.environ.get(SAMPLE_ENV) or "1"
+        try:
+            _sample_rate = int(value)
+            if _sample_rate < 1:
+                raise ValueError
+        except ValueError:
+            print(f"⚠️ Invalid {SAMPLE_ENV}={value!r}, expected a whole number >= 1; profiling every request")
+            _sample_rate = 1
+    return _sample_rate
+
+def should_profile(force=False) -> bool:
+    """
+    Decide whether the current request should be profiled.
+
+    A request is profiled when `force` is set, or when profiling is enabled via
+    the environment and the request falls on the 1-in-N sample.
+    """
+    if force:
+        return True
+    if os.environ.get(PROFILE_ENV, "").lower() not in ("1", "true", "yes"):
+        return False
+    return next(_request_counter) % sample_rate() == 0
+
+@contextlib.contextmanager
+def stage(name: str):
+    """
+    Time a named stage of the request being profiled.
+
+    Does nothing unless a profiled request is running on this thread, so stages
+    can stay in the hot path permanently. Repeated stages are summed.
+    """
+    timings = getattr(_state, 'timings', None)
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+def profile_call(fn, *args, request_input=None, force=False, **kwargs):
+    """
+    Call `fn`, capturing a cProfile profile and stage timings if selected.
+
+    When the call is profiled, the `.prof` file and a JSON file holding the
+    request input, total time and per-stage timings are written to the profile
+    directory (RECOMMENDER_PROFILE_DIR, default `profiles/`). Nested calls run
+    unprofiled inside the outer profile. Failing to save a profile is logged
+    and never fails the request itself.
+    """
+    if getattr(_state, 'timings', None) is not None or not should_profile(force):
+        return fn(*args, **kwargs)
+
+    _state.timings = {}
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        return profiler.runcall(fn, *args, **kwargs)
+    finally:
+        total = time.perf_counter() - start
+        timings, _state.timings = _state.timings, None
+        try:
+            _save_profile(profiler, {
+                'input': request_input,
+                'timestamp': time.time(),
+                'pid': os.getpid(),
+                'total_s': total,
+                'stages_s': timings,
+            })
+        except Exception as e:
+            print(f"❌ Failed to save request profile: {e}")
+
+def _save_profile(profiler: cProfile.Profile, record: dict):
+    """
+    Write a captured profile and its JSON record side by side.
+    """
+    profile_dir = Path(os.environ.get(DIR_ENV, DEFAULT_PROFILE_DIR))
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    name = f"{time.time_ns()}-{os.getpid()}"
+    profiler.dump_stats(profile_dir / f"{name}.prof")
+    with open(profile_dir / f"{name}.json", 'w') as f:
+        json.dump(record, f, indent=2)
+
+def stage_report(records: list) -> list:
+    """
+    Summarize stage timings across requests.
+
+    Returns (stage, requests, mean seconds, max seconds) rows, slowest mean first.
+    """
+    stages = {}
+    for record in records:
+        for name, seconds in record['stages_s'].items():
+            stages.setdefault(name, []).append(seconds)
+    rows = [
+        (name, len(times), sum(times) / len(times), max(times))
+        for name, times in stages.items()
+    ]
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+def hot_function_report(profile_dir=DEFAULT_PROFILE_DIR, top=30, sort='tottime'):
+    """
+    Aggregate every captured profile into a ranked hot-function report.
+
+    Merges all `.prof` files in `profile_dir` and prints the stage timings
+    followed by the `top` functions ordered by `sort` (any pstats sort key).
+    """
+    profile_dir = Path(profile_dir)
+    profiles = sorted(profile_dir.glob("*.prof"))
+    if not profiles:
+        print(f"No profiles found in {profile_dir}/")
+        return
+
+    records = []
+    for path in profile_dir.glob("*.json"):
+        with open(path) as f:
+            records.append(json.load(f))
+
+    totals = sorted(record['total_s'] for record in records)
+    print(f"{len(profiles)} profiled requests")
+    if totals:
+        print(f"Total time: mean {sum(totals) / len(totals):.3f}s, max {totals[-1]:.3f}s\n")
+
+    print(f"{'Stage':<24}{'Requests':>10}{'Mean (s)':>12}{'Max (s)':>12}")
+    for name, count, mean, peak in stage_report(records):
+        print(f"{name:<24}{count:>10}{mean:>12.4f}{peak:>12.4f}")
+    print()
+
+    stats = pstats.Stats(*(str(path) for path in profiles))
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate captured request profiles")
+    parser.add_argument("profile_dir", nargs="?", default=os.environ.get(DIR_ENV, DEFAULT_PROFILE_DIR))
+    parser.add_argument("--top", type=int, default=30)
+    parser.add_argument("--sort", default="tottime")
+    args = parser.parse_args()
+
+    hot_function_report(args.profile_dir, args.top, args.sort)
@@ -0,0 +1,284 @@
+import argparse
+import functools
+import gc
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+
+import main
+
+# Seconds a web request waits for its worker before giving up
+DEFAULT_TIMEOUT = 30.0
+
+def _worker_loop(worker_id: int, requests, responses):
+    """
+    Serve recommendation requests in a forked worker process.
+
+    The model and movies were loaded by the parent before forking, so the
+    worker uses them through the inherited `main` module globals. Large
+    buffers (NumPy/SciPy arrays, the FAISS index, the memory-mapped similarity
+    matrix) are shared with the parent and never written to. Per-version
+    request metrics are sent back with every response.
+    """
+    registry = main.model_registry
+    if registry is not None:
+        # The parent's collector thread may have held a version lock at the fork
+        registry.after_fork()
+        registry.forward_records()
+
+    try:
+        import faiss
+        # N workers each running all-core OpenMP searches would oversubscribe the CPU
+        faiss.omp_set_num_threads(1)
+    except ImportError:
+        pass
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, user_input, user_id, filters = request
+        try:
+            result, error = main.recommend_movies(user_input, user_id=user_id, **filters), None
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+        records = registry.take_records() if registry is not None else []
+        responses.send((request_id, worker_id, result, error, records))
+
+class WorkerPool:
+    """
+    A pre-fork pool of recommendation workers sharing one loaded model.
+
+    The parent process loads the movies and hybrid model once and then forks
+    `n_workers` processes, which inherit the loaded model copy-on-write instead
+    of each loading their own copy. Requests are routed to the worker with the
+    fewest requests in flight, so throughput scales with the number of cores
+    while each additional worker only costs its private pages.
+
+    Every worker answers on its own pipe, so a worker that is killed (e.g. by
+    the OOM killer) cannot block the others. Its pending requests fail and it
+    receives no further requests. `reload` deploys new model versions in the
+    parent and then replaces the workers with fresh forks.
+    """
+
+    def __init__(self, n_workers: int = os.cpu_count() or 1):
+        """
+        Load the model in this process and fork the worker processes.
+        """
+        main.init_components()
+        # Registry versions are warmed as they are loaded
+        if main.hybrid_model is not None:
+            main.hybrid_model.warm_up()
+
+        self.n_workers = n_workers
+        self._context = multiprocessing.get_context('fork')
+        self._lock = threading.Lock()
+        self._workers = {}  # worker ID -> process
+        self._requests = {}  # worker ID -> request queue
+        self._responses = {}  # worker ID -> response pipe
+        self._in_flight = {}  # worker ID -> number of pending requests
+        self._retiring = set()  # workers finishing their requests before exiting
+        self._pending = {}  # request ID -> (future, worker ID)
+        self._closing = False
+        self._worker_ids = itertools.count()
+        self._request_ids = itertools.count()
+        # Wakes the collector up when workers are added
+        self._wakeup, self._notify = self._context.Pipe(duplex=False)
+
+        self._fork_workers(n_workers)
+
+        self._collector = threading.Thread(target=self._collect_responses, daemon=True)
+        self._collector.start()
+
+    def _fork_workers(self, n_workers: int) -> list:
+        """
+        Fork `n_workers` new workers and start routing requests to them.
+        """
+        # Move everything loaded so far out of the garbage collector's reach so
+        # that collections in the workers do not touch (and copy) shared pages.
+        # Objects frozen for earlier workers are unfrozen first, so a model
+        # replaced since then can still be collected here.
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+
+        worker_ids = []
+        for _ in range(n_workers):
+            worker_id = next(self._worker_ids)
+            requests = self._context.Queue()
+            responses, worker_end = self._context.Pipe(duplex=False)
+            worker = self._context.Process(
+                target=_worker_loop,
+                args=(worker_id, requests, worker_end),
+                daemon=True,
+            )
+            worker.start()
+            # Only the worker writes to its pipe; later workers must not inherit it
+            worker_end.close()
+            with self._lock:
+                self._workers[worker_id] = worker
+                self._requests[worker_id] = requests
+                self._responses[worker_id] = responses
+                self._in_flight[worker_id] = 0
+            worker_ids.append(worker_id)
+        self._notify.send(None)
+        return worker_ids
+
+    def _collect_responses(self):
+        """
+        Resolve pending futures as the workers send back their results.
+
+        Waits on every worker's pipe and process sentinel at once, so a worker
+        exiting is noticed as soon as it happens. Returns once the pool is
+        closed and no worker is left.
+        """
+        while True:
+            with self._lock:
+                if self._closing and not self._workers:
+                    break
+                pipes = {self._responses[worker_id]: worker_id for worker_id in self._workers}
+                sentinels = {worker.sentinel: worker_id for worker_id, worker in self._workers.items()}
+
+            ready = wait([self._wakeup, *pipes, *sentinels])
+            if self._wakeup in ready:
+                self._wakeup.recv()
+            for connection in ready:
+                if connection in pipes:
+                    try:
+                        self._resolve(*connection.recv())
+                    except EOFError:
+                        pass  # handled through the worker's sentinel
+            for sentinel in ready:
+                if sentinel in sentinels:
+                    self._worker_exited(sentinels[sentinel])
+
+    def _resolve(self, request_id: int, worker_id: int, result, error, records):
+        """
+        Resolve the future of one request with its result or error.
+
+        The worker's model version `records` are merged into the parent's
+        registry, which the metrics panel reads.
+        """
+        if records and main.model_registry is not None:
+            main.model_registry.merge_records(records)
+        with self._lock:
+            future, _ = self._pending.pop(request_id)
+            self._in_flight[worker_id] -= 1
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(RuntimeError(error))
+
+    def _worker_exited(self, worker_id: int):
+        """
+        Forget an exited worker and fail the requests it still held.
+        """
+        worker, responses = self._workers[worker_id], self._responses[worker_id]
+        # Results sent just before exiting are still in the pipe
+        while responses.poll():
+            try:
+                self._resolve(*responses.recv())
+            except EOFError:
+                break
+
+        worker.join()
+        with self._lock:
+            lost = [request_id for request_id, (_, owner) in self._pending.items() if owner == worker_id]
+            futures = [self._pending.pop(request_id)[0] for request_id in lost]
+            expected = self._closing or worker_id in self._retiring
+            for table in (self._workers, self._requests, self._responses, self._in_flight):
+                del table[worker_id]
+            self._retiring.discard(worker_id)
+        responses.close()
+
+        if not expected:
+            print(f"❌ Worker {worker_id} (pid {worker.pid}) exited with code {worker.exitcode}")
+        for future in futures:
+            future.set_exception(RuntimeError(f"Worker {worker_id} exited with code {worker.exitcode}"))
+
+    def submit(self, user_input: str, user_id=None, **filters) -> Future:
+        """
+        Route a request to the least busy worker and return a future for its result.
+
+        `filters` are passed on to `main.recommend_movies`.
+        """
+        future = Future()
+        with self._lock:
+            serving = [worker_id for worker_id in self._workers if worker_id not in self._retiring]
+            if not serving:
+                raise RuntimeError("No recommendation worker is running")
+            request_id = next(self._request_ids)
+            worker_id = min(serving, key=self._in_flight.__getitem__)
+            self._in_flight[worker_id] += 1
+            self._pending[request_id] = (future, worker_id)
+            requests = self._requests[worker_id]
+        requests.put((request_id, user_input, user_id, filters))
+        return future
+
+    def recommend(self, user_input: str, user_id=None, timeout=DEFAULT_TIMEOUT, **filters) -> str:
+        """
+        Generate recommendations in a worker process and wait for the result.
+
+        Drop-in replacement for `main.recommend_movies`. Raises TimeoutError if
+        no result arrives within `timeout` seconds (None waits forever).
+        """
+        return self.submit(user_input, user_id, **filters).result(timeout)
+
+    def restart_workers(self):
+        """
+        Replace every worker with a fresh fork of this process.
+
+        Workers only see the model they were forked with, so this is needed
+        after the parent's model changed. The pool is also brought back to
+        `n_workers` if workers died. New workers take requests right away; the
+        old ones finish the requests they already hold and then exit.
+        """
+        with self._lock:
+            old = [worker_id for worker_id in self._workers if worker_id not in self._retiring]
+        self._fork_workers(self.n_workers)
+        with self._lock:
+            self._retiring.update(old)
+            queues = [self._requests[worker_id] for worker_id in old if worker_id in self._requests]
+        for requests in queues:
+            requests.put(None)
+
+    def reload(self, spec: str | None = None) -> dict:
+        """
+        Deploy model versions in the parent and restart the workers on them.
+
+        See `main.reload_models`; the current workers keep serving while the
+        new versions load and warm up. Returns the new model metrics.
+        """
+        metrics = main.reload_models(spec)
+        self.restart_workers()
+        return metrics
+
+    def close(self):
+        """
+        Stop the workers and the response collector.
+        """
+        with self._lock:
+            self._closing = True
+            queues = list(self._requests.values())
+        for requests in queues:
+            requests.put(None)
+        self._notify.send(None)
+        self._collector.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve recommendations from a pool of worker processes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="seconds a request waits for its worker")
+    args = parser.parse_args()
+
+    pool = WorkerPool(args.workers)
+    main.install_reload_handler(pool.reload)
+    print(f"\nLaunching Gradio interface with {args.workers} workers...")
+    main.build_demo(
+        fn=functools.partial(pool.recommend, timeout=args.timeout),
+        concurrency_limit=args.workers,
+    ).launch(share=True)
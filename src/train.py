@@ -1,10 +1,14 @@
 import pandas as pd
 import numpy as np
-import joblib
-import faiss
 import difflib
-from scipy.sparse import csr_matrix
-from utils import DataHandler, ContentModel
+from utils import DataHandler, ContentModel, FilterIndex
+from request_profiler import stage
+
+# faiss, joblib and scipy are imported inside the functions that need them so
+# that importing this module (e.g. just to unpickle a model) stays cheap.
+
+# Candidates drawn from each source before re-ranking, see HybridModel.recommend_profile()
+DEFAULT_CANDIDATE_LIMITS = {'collaborative': 300, 'content': 200, 'popular': 100}
 
 class HybridModel:
     """
@@ -36,6 +40,8 @@ class HybridModel:
         1. A sparse matrix representation of user-item interactions
         2. Mappings from user/movie IDs to matrix indices
         """
+        from scipy.sparse import csr_matrix
+
         # Create mappings
         user_ids = self.ratings['userId'].unique()
         movie_ids = self.ratings['movieId'].unique()
@@ -63,6 +69,8 @@ class HybridModel:
         2. Normalizing vectors using L2 normalization
         3. Creating and training a FAISS index for fast similarity search
         """
+        import faiss
+
         dense_matrix = self.sparse_matrix.toarray().astype('float32')
         faiss.normalize_L2(dense_matrix)
         index = faiss.IndexFlatIP(dense_matrix.shape[1])
@@ -81,83 +89,347 @@ class HybridModel:
         matches = difflib.get_close_matches(input_title, titles, n=1, cutoff=0.6)
         return matches[0] if matches else None
 
-    def hybrid_recommend(self, user_ratings: dict, content_weight=0.4, top_n=5) -> pd.DataFrame:
+    def _lookups(self) -> dict:
+        """
+        Return the lookup tables between movie IDs, catalog rows and matrix columns.
+
+        Catalog rows are positions in `self.movies`; matrix columns are positions
+        in the collaborative rating matrix. The tables are built on first use so
+        that models pickled before they existed still load.
+        """
+        lookups = getattr(self, '_lookup_tables', None)
+        if lookups is None:
+            movie_ids = self.movies['movieId'].to_numpy()
+            row_of_movie = pd.Series(np.arange(len(movie_ids)), index=movie_ids)
+            row_of_movie = row_of_movie[~row_of_movie.index.duplicated()]
+
+            column_ids = np.empty(len(self.movie_mapper), dtype=movie_ids.dtype)
+            for movie_id, column in self.movie_mapper.items():
+                column_ids[column] = movie_id
+
+            # Catalog row of every matrix column and matrix column of every catalog row (-1 if absent)
+            column_rows = row_of_movie.reindex(column_ids).fillna(-1).to_numpy(dtype=np.int64)
+            row_columns = np.full(len(movie_ids), -1, dtype=np.int64)
+            row_columns[column_rows[column_rows >= 0]] = np.flatnonzero(column_rows >= 0)
+
+            # Catalog rows of the rated movies, most rated first
+            rating_counts = self.sparse_matrix.getnnz(axis=0)
+            popular_rows = column_rows[np.argsort(-rating_counts, kind='stable')]
+
+            # Number of ratings of every catalog movie, for the filter index
+            row_counts = np.zeros(len(movie_ids), dtype=np.int64)
+            row_counts[column_rows[column_rows >= 0]] = rating_counts[column_rows >= 0]
+
+            indices = pd.Series(np.arange(len(self.movies)), index=self.movies['title'])
+            lookups = {
+                'row_of_movie': row_of_movie,
+                'row_of_title': indices[~indices.index.duplicated()],
+                'column_rows': column_rows,
+                'row_columns': row_columns,
+                'popular_rows': popular_rows[popular_rows >= 0],
+                'filter_index': FilterIndex(self.movies, rating_counts=row_counts),
+            }
+            self._lookup_tables = lookups
+        return lookups
+
+    def _content(self) -> ContentModel:
+        """
+        Return the content model, building it once per loaded model.
+        """
+        content_model = getattr(self, '_content_model', None)
+        if content_model is None:
+            with stage("content_model_build"):
+                content_model = ContentModel(self.movies)
+            self._content_model = content_model
+        return content_model
+
+    def warm_up(self):
+        """
+        Build the lookup tables, content model and content neighbor table ahead
+        of the first request.
+        """
+        self._lookups()
+        self._content().neighbors()
+        return self
+
+    def memory_usage(self) -> int:
+        """
+        Return the approximate number of bytes held by the model.
+
+        Counts the DataFrames, the rating matrix, the FAISS index vectors and
+        the similarity matrix if it is held in memory (a memory-mapped one is
+        shared through the page cache and not counted).
+        """
+        total = int(self.movies.memory_usage(deep=True).sum())
+        total += int(self.ratings.memory_usage(deep=True).sum())
+        total += sum(a.nbytes for a in (self.sparse_matrix.data, self.sparse_matrix.indices, self.sparse_matrix.indptr))
+        total += self.model.ntotal * self.model.d * 4
+
+        content_model = getattr(self, '_content_model', None)
+        if content_model is not None and not isinstance(content_model.cosine_sim, np.memmap):
+            total += content_model.cosine_sim.nbytes
+        return total
+
+    def __getstate__(self):
+        """
+        Drop caches derived from the movies so they are not pickled with the model.
+        """
+        state = self.__dict__.copy()
+        state.pop('_lookup_tables', None)
+        state.pop('_content_model', None)
+        return state
+
+    def build_profile(self, movie_ids, ratings, timestamps=None, half_life_days=None, center=True):
+        """
+        Build a sparse user profile from arrays of rated movie IDs.
+
+        The profile is a (1, n_movies) CSR row over catalog rows of `self.movies`
+        holding one weight per rated movie. Ratings are mean-centered (when they
+        are not all equal) so that below-average ratings act as dislikes, and if
+        `half_life_days` and `timestamps` are given, older ratings are decayed
+        exponentially relative to the most recent one. Unknown movie IDs are
+        ignored entirely, so they do not shift the mean or the most recent
+        rating. Everything is done in NumPy, so the cost barely depends on the
+        length of the history.
+        """
+        from scipy.sparse import csr_matrix
+
+        lookups = self._lookups()
+        rows = lookups['row_of_movie'].reindex(np.asarray(movie_ids)).to_numpy()
+        known = ~np.isnan(rows)
+        rows = rows[known].astype(np.int64)
+        weights = np.asarray(ratings, dtype='float32')[known]
+
+        if center and len(weights) and np.ptp(weights) > 0:
+            weights = weights - weights.mean()
+
+        if half_life_days and timestamps is not None and len(weights):
+            timestamps = np.asarray(timestamps, dtype='float64')[known]
+            age_days = (timestamps.max() - timestamps) / 86400
+            weights = weights * np.power(0.5, age_days / half_life_days).astype('float32')
+
+        profile = csr_matrix(
+            (weights, (np.zeros(len(rows), dtype=np.int64), rows)),
+            shape=(1, len(self.movies)),
+        )
+        profile.eliminate_zeros()
+        return profile
+
+    def content_scores(self, profile) -> np.ndarray:
+        """
+        Score every catalog movie by genre similarity to the profile.
+        """
+        return self._content().profile_scores(profile.indices, profile.data)
+
+    def _collaborative_row_scores(self, profile, n_neighbors=50):
+        """
+        Score the movies rated by the users most similar to the profile.
+
+        The profile is projected onto the rating-matrix columns, the FAISS index
+        returns the `n_neighbors` most similar users, and their ratings are
+        combined weighted by similarity. Only the movies those users rated are
+        touched. Returns their catalog rows and scores, scaled to at most 1.
+        """
+        import faiss
+        from scipy.sparse import csr_matrix
+
+        lookups = self._lookups()
+        no_scores = (np.empty(0, dtype=np.int64), np.empty(0))
+
+        columns = lookups['row_columns'][profile.indices]
+        in_matrix = columns >= 0
+        if not in_matrix.any():
+            return no_scores
+
+        query = np.zeros((1, self.sparse_matrix.shape[1]), dtype='float32')
+        query[0, columns[in_matrix]] = profile.data[in_matrix]
+        faiss.normalize_L2(query)
+        similarities, users = self.model.search(query, n_neighbors)
+        found = users[0] >= 0
+        if not found.any():
+            return no_scores
+
+        weights = csr_matrix(similarities[0][found][None, :].astype('float64'))
+        column_scores = (weights @ self.sparse_matrix[users[0][found]]).tocsr()
+        column_scores.sum_duplicates()
+
+        rows = lookups['column_rows'][column_scores.indices]
+        in_catalog = rows >= 0
+        rows, scores = rows[in_catalog], column_scores.data[in_catalog]
+
+        peak = np.abs(scores).max(initial=0)
+        return rows, (scores / peak if peak > 0 else scores)
+
+    def collaborative_scores(self, profile, n_neighbors=50) -> np.ndarray:
+        """
+        Score every catalog movie from the ratings of the most similar users.
+
+        Movies none of the neighbors rated score 0. Scores are scaled to at most 1.
+        """
+        rows, row_scores = self._collaborative_row_scores(profile, n_neighbors)
+        scores = np.zeros(len(self.movies))
+        scores[rows] = row_scores
+        return scores
+
+    def filter_mask(self, genres=None, exclude_genres=None, year_range=None, min_ratings=None):
+        """
+        Compile business filters into a boolean mask over catalog rows.
+
+        See `FilterIndex.compile_mask`; returns None when no filter is set.
+        """
+        return self._lookups()['filter_index'].compile_mask(genres, exclude_genres, year_range, min_ratings)
+
+    def generate_candidates(self, profile, collaborative, exclude_rows=None, candidate_limits=None,
+                            exhaustive=False, mask=None) -> np.ndarray:
+        """
+        Generate the catalog rows worth scoring exactly for a profile.
+
+        Candidates are the union of the highest collaborative scores (from the
+        (rows, scores) pair returned by `_collaborative_row_scores`), the
+        nearest content neighbors of the positively rated movies and the most
+        rated movies, each capped by `candidate_limits` (see
+        DEFAULT_CANDIDATE_LIMITS). With `exhaustive=True` every catalog movie is
+        a candidate. Rows in `exclude_rows` (the movies the user has rated) and
+        rows failing the boolean filter `mask` (see `filter_mask`) are dropped
+        from every source before its cap, so neither eats into the limits, even
+        for long histories.
+        """
+        limits = {**DEFAULT_CANDIDATE_LIMITS, **(candidate_limits or {})}
+
+        if exclude_rows is not None and len(exclude_rows):
+            mask = np.ones(len(self.movies), dtype=bool) if mask is None else mask.copy()
+            mask[exclude_rows] = False
+
+        if exhaustive:
+            candidates = np.arange(len(self.movies)) if mask is None else np.flatnonzero(mask)
+        else:
+            collab_rows, collab_scores = collaborative
+            popular_rows = self._lookups()['popular_rows']
+            if mask is not None:
+                passes = mask[collab_rows]
+                collab_rows, collab_scores = collab_rows[passes], collab_scores[passes]
+                popular_rows = popular_rows[mask[popular_rows]]
+
+            n_collab = min(limits['collaborative'], len(collab_rows))
+            if n_collab < len(collab_rows):
+                collab_rows = collab_rows[np.argpartition(-collab_scores, n_collab - 1)[:n_collab]]
+
+            liked = profile.data > 0
+            seeds = profile.indices[liked][np.argsort(-profile.data[liked])]
+            content_rows = self._content().nearest_neighbors(seeds, limits['content'], mask)
+
+            candidates = pd.unique(np.concatenate(
+                [collab_rows, content_rows, popular_rows[:limits['popular']]]
+            ).astype(np.int64))
+        return candidates
+
+    def recommend_profile(self, profile, exclude_rows=None, content_weight=0.4, top_n=5,
+                          candidate_limits=None, exhaustive=False, n_neighbors=50,
+                          genres=None, exclude_genres=None, year_range=None, min_ratings=None) -> pd.DataFrame:
+        """
+        Recommend movies for a profile built by `build_profile`.
+
+        Runs a two-stage pipeline: `generate_candidates` pulls a few hundred
+        candidates passing the filters (see `filter_mask`) from the
+        collaborative neighbors, content neighbors and the popularity list,
+        then only those candidates are scored exactly by blending content and
+        collaborative scores with `content_weight`. The cost of a request
+        therefore depends on the candidate limits rather than the catalog
+        size. The `top_n` highest scoring movies are returned with their
+        `movieId`, `title` and `genres`, skipping `exclude_rows` (catalog rows
+        the user has already rated).
+        """
+        if profile.nnz == 0:
+            return pd.DataFrame(columns=['movieId', 'title', 'genres'])
+
+        with stage("filter_mask"):
+            mask = self.filter_mask(genres, exclude_genres, year_range, min_ratings)
+
+        with stage("collaborative_scores"):
+            collab_rows, collab_scores = self._collaborative_row_scores(profile, n_neighbors)
+
+        with stage("candidates"):
+            candidates = self.generate_candidates(
+                profile, (collab_rows, collab_scores), exclude_rows, candidate_limits, exhaustive, mask,
+            )
+
+        with stage("content_scores"):
+            scores = content_weight * self._content().profile_scores(profile.indices, profile.data, candidates)
+
+        with stage("rank"):
+            # Look up the collaborative score of each candidate (0 if no neighbor rated it)
+            order = np.argsort(collab_rows)
+            positions = np.searchsorted(collab_rows, candidates, sorter=order).clip(max=max(len(order) - 1, 0))
+            if len(order):
+                matched = collab_rows[order[positions]] == candidates
+                scores[matched] += (1 - content_weight) * collab_scores[order[positions[matched]]]
+
+            top = np.argsort(-scores, kind='stable')[:top_n]
+            return self.movies.iloc[candidates[top]][['movieId', 'title', 'genres']]
+
+    def recommend_from_history(self, movie_ids, ratings, timestamps=None, content_weight=0.4,
+                               top_n=5, half_life_days=None, **options) -> pd.DataFrame:
+        """
+        Recommend movies from a rating history given as arrays.
+
+        `movie_ids`, `ratings` and the optional `timestamps` are parallel arrays,
+        so a history of hundreds of ratings, dislikes included, can be scored
+        without any per-title work. Rated movies are never recommended. Further
+        `options` (candidate limits, filters) are passed to `recommend_profile`.
+        """
+        with stage("build_profile"):
+            profile = self.build_profile(movie_ids, ratings, timestamps, half_life_days)
+            rated_rows = self._lookups()['row_of_movie'].reindex(np.asarray(movie_ids)).dropna()
+        return self.recommend_profile(
+            profile, rated_rows.to_numpy(dtype=np.int64), content_weight, top_n, **options,
+        )
+
+    def hybrid_recommend(self, user_ratings: dict, content_weight=0.4, top_n=5, **options) -> pd.DataFrame:
         """
         Generate hybrid recommendations combining content-based and collaborative filtering.
 
         This method implements a hybrid recommendation approach that:
-        1. Generates content-based recommendations using movie genres
-        2. Creates collaborative filtering recommendations using user similarity
-        3. Combines both approaches to provide diverse, high-quality recommendations
-        4. Handles fuzzy matching for movie titles to improve usability
+        1. Matches the given titles to movies, using fuzzy matching for inexact titles
+        2. Builds a weighted user profile from the matched ratings
+        3. Blends content-based and collaborative scores for a set of candidate movies
+        4. Returns the highest scoring movies the user has not rated
+
+        Further `options` (candidate limits, filters) are passed to `recommend_profile`.
         """
         print(f"Debug: Input user_ratings: {user_ratings}")
 
-        # Content-based recommendations
-        content_model = ContentModel(self.movies)
-        content_recs = content_model.content_recommendations(user_ratings, top_n*2)
-        print(f"Debug: Content recommendations: {content_recs['title'].tolist()}")
-
-        # Collaborative filtering
-        user_profile = np.zeros(self.sparse_matrix.shape[1], dtype='float32')
-        matched_titles = {}
-
-        for title, rating in user_ratings.items():
-            matched_title = self.find_closest_title(title)
-            if matched_title:
-                matched_titles[title] = matched_title
-                movie_id = self.movies[self.movies['title'] == matched_title]['movieId'].values[0]
-                if movie_id in self.movie_mapper:
-                    movie_idx = self.movie_mapper[movie_id]
-                    user_profile[movie_idx] = rating
-                    print(f"Debug: {title} → {matched_title} (movie_id: {movie_id}, idx: {movie_idx})")
-
-        collab_movies = []
-        if np.count_nonzero(user_profile) == 0:
+        row_of_title = self._lookups()['row_of_title']
+        movie_ids, ratings = [], []
+        with stage("match_titles"):
+            for title, rating in user_ratings.items():
+                matched_title = title if title in row_of_title.index else self.find_closest_title(title)
+                if matched_title:
+                    movie_id = self.movies['movieId'].iat[row_of_title[matched_title]]
+                    movie_ids.append(movie_id)
+                    ratings.append(rating)
+                    print(f"Debug: {title} → {matched_title} (movie_id: {movie_id})")
+
+        if not movie_ids:
             print("⚠️ Warning: No matched titles found in user input!")
-        else:
-            faiss.normalize_L2(user_profile.reshape(1, -1))
-            _, indices = self.model.search(user_profile.reshape(1, -1), top_n * 3)
-            print(f"Debug: Collaborative indices: {indices[0]}")
-
-            # Get movie IDs from indices
-            inv_movie_mapper = {v: k for k, v in self.movie_mapper.items()}
-            for idx in indices[0]:
-                movie_id = inv_movie_mapper.get(idx)
-                if movie_id:
-                    movie_row = self.movies[self.movies['movieId'] == movie_id]
-                    if not movie_row.empty:
-                        title = movie_row['title'].values[0]
-                        # Don't recommend movies the user already rated
-                        if title not in user_ratings.keys() and title not in matched_titles.values():
-                            collab_movies.append(title)
-
-        print(f"Debug: Collaborative movies: {collab_movies}")
-
-        # Combine results - this was the main bug!
-        all_recommendations = set()
-
-        # Add content-based recommendations
-        for title in content_recs['title'].tolist():
-            if title not in user_ratings.keys() and title not in matched_titles.values():
-                all_recommendations.add(title)
-
-        # Add collaborative recommendations
-        for title in collab_movies:
-            all_recommendations.add(title)
-
-        # Convert to list and get top N
-        final_recommendations = list(all_recommendations)[:top_n]
-        print(f"Debug: Final recommendations: {final_recommendations}")
-
-        # Return properly formatted DataFrame
-        if final_recommendations:
-            result_df = self.movies[self.movies['title'].isin(final_recommendations)][['title', 'genres']].head(top_n)
-            return result_df
-        else:
-            return pd.DataFrame(columns=['title', 'genres'])
+            return pd.DataFrame(columns=['movieId', 'title', 'genres'])
 
-def train_model():
+        recommendations = self.recommend_from_history(
+            movie_ids, ratings, content_weight=content_weight, top_n=top_n, **options,
+        )
+        print(f"Debug: Final recommendations: {recommendations['title'].tolist()}")
+        return recommendations
+
+def downsample_ratings(ratings: pd.DataFrame, n_users=20000, n_movies=10000) -> pd.DataFrame:
+    """
+    Keep only the ratings of the most active users on the most rated movies.
+
+    The collaborative index is dense over users, so this bounds its memory use.
+    """
+    top_users = ratings['userId'].value_counts().head(n_users).index
+    top_movies = ratings['movieId'].value_counts().head(n_movies).index
+    return ratings[ratings['userId'].isin(top_users) & ratings['movieId'].isin(top_movies)]
+
+def train_model(model_path="hybrid_model.joblib", n_users=20000, n_movies=10000):
     """
     Train and save the hybrid recommendation model.
 
@@ -168,8 +440,12 @@ def train_model():
     4. Saves the trained model to disk using joblib
 
     The function performs data downsampling to improve training speed and memory usage
-    by selecting the top 20,000 most active users and top 10,000 most rated movies.
+    by selecting the top `n_users` most active users (20,000 by default) and top
+    `n_movies` most rated movies (10,000 by default). Saving variants under
+    different `model_path`s lets several model versions be served side by side.
     """
+    import joblib
+
     # Initialize data handler
     data_handler = DataHandler("data/")
 
@@ -177,9 +453,7 @@ def train_model():
     movies, ratings = data_handler.load_data("movies.csv", "ratings.csv")
 
     # downsample
-    top_users = ratings['userId'].value_counts().head(20000).index
-    top_movies = ratings['movieId'].value_counts().head(10000).index
-    ratings = ratings[ratings['userId'].isin(top_users) & ratings['movieId'].isin(top_movies)]
+    ratings = downsample_ratings(ratings, n_users, n_movies)
 
     # Train hybrid model
     movies = data_handler.preprocess_movies(movies)
@@ -188,19 +462,29 @@ def train_model():
     # Save model with proper module reference
     import __main__
     __main__.HybridModel = HybridModel
-    joblib.dump(model, "hybrid_model.joblib")
-    print("Hybrid model trained and saved!")
+    joblib.dump(model, model_path)
+    print(f"Hybrid model trained and saved to {model_path}!")
 
-def load_hybrid_model():
+def load_hybrid_model(model_path="hybrid_model.joblib"):
     """
     Load a pre-trained hybrid recommendation model from disk.
 
     This helper function loads a previously saved hybrid model using joblib,
     ensuring proper class reference resolution for successful deserialization.
     """
+    import joblib
+
     import __main__
     __main__.HybridModel = HybridModel
-    return joblib.load("hybrid_model.joblib")
+    return joblib.load(model_path)
 
 if __name__ == "__main__":
-    train_model()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train and save the hybrid recommendation model")
+    parser.add_argument("--output", default="hybrid_model.joblib")
+    parser.add_argument("--n-users", type=int, default=20000)
+    parser.add_argument("--n-movies", type=int, default=10000)
+    args = parser.parse_args()
+
+    train_model(args.output, args.n_users, args.n_movies)
@@ -0,0 +1,417 @@
+import sys
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Add the current directory to Python path so the modules import without installing
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from evaluate import ranking_metrics
+from model_registry import ModelRegistry, ModelVersion, parse_model_spec
+from utils import DataHandler, FilterIndex
+from train import HybridModel
+
+def naive_ranking_metrics(recommended: list, relevant: list, k: int) -> dict:
+    """
+    Compute the ranking metrics of one user with plain loops, as a reference.
+    """
+    relevant = set(relevant)
+    hits = [movie_id in relevant for movie_id in recommended[:k]]
+    n_hits = sum(hits)
+
+    dcg = sum(1 / np.log2(rank + 2) for rank, hit in enumerate(hits) if hit)
+    idcg = sum(1 / np.log2(rank + 2) for rank in range(min(len(relevant), k)))
+
+    precision_sum, seen = 0.0, 0
+    for rank, hit in enumerate(hits):
+        if hit:
+            seen += 1
+            precision_sum += seen / (rank + 1)
+
+    return {
+        'precision': n_hits / k,
+        'recall': n_hits / len(relevant) if relevant else 0.0,
+        'ndcg': dcg / idcg if idcg else 0.0,
+        'average_precision': precision_sum / min(len(relevant), k) if relevant else 0.0,
+    }
+
+def test_ranking_metrics():
+    """
+    The vectorized metrics match a per-user loop, including padded and empty rows.
+    """
+    k = 5
+    recommended = [
+        [1, 2, 3, 4, 5],
+        [9, 8, -1, -1, -1],   # fewer than k recommendations
+        [7, 6, 5, 4, 3],
+        [1, 2, 3, 4, 5],
+    ]
+    relevant = [
+        [2, 5, 11],
+        [8],
+        [10, 20],             # no hits
+        [],                   # nothing relevant
+    ]
+
+    metrics = ranking_metrics(np.array(recommended), [np.array(items) for items in relevant], k)
+    for user, (recs, items) in enumerate(zip(recommended, relevant)):
+        expected = naive_ranking_metrics([r for r in recs if r >= 0], items, k)
+        for name, value in expected.items():
+            assert np.isclose(metrics[name][user], value), (user, name, metrics[name][user], value)
+
+def test_ranking_metrics_random():
+    """
+    The vectorized metrics match a per-user loop on random recommendations.
+    """
+    rng = np.random.default_rng(0)
+    k = 10
+    recommended = np.array([rng.choice(100, k, replace=False) for _ in range(50)])
+    relevant = [rng.choice(100, rng.integers(0, 15), replace=False) for _ in range(50)]
+
+    metrics = ranking_metrics(recommended, relevant, k)
+    for user in range(len(recommended)):
+        expected = naive_ranking_metrics(recommended[user].tolist(), relevant[user].tolist(), k)
+        for name, value in expected.items():
+            assert np.isclose(metrics[name][user], value), (user, name)
+
+class _FakeModel:
+    """
+    Stands in for a HybridModel where only routing is tested.
+    """
+
+    def memory_usage(self) -> int:
+        return 0
+
+def _registry(*names: str) -> ModelRegistry:
+    """
+    Build a registry holding fake versions with the given names.
+    """
+    registry = ModelRegistry()
+    registry.versions = {name: ModelVersion(name, __file__, _FakeModel(), 0.0, None) for name in names}
+    return registry
+
+def test_parse_model_spec():
+    """
+    Weights default to 1, entries may be split by commas or lines, bad specs raise.
+    """
+    assert parse_model_spec("current=hybrid_model.joblib") == [("current", "hybrid_model.joblib", 1.0)]
+    assert parse_model_spec("a=a.joblib:90,\nb=b.joblib:10\n") == [("a", "a.joblib", 90.0), ("b", "b.joblib", 10.0)]
+    for spec in ("a=a.joblib:0", "a=a.joblib:ninety", "=a.joblib", "a="):
+        try:
+            parse_model_spec(spec)
+        except ValueError:
+            continue
+        raise AssertionError(f"{spec!r} should be rejected")
+
+def test_set_routes():
+    """
+    Traffic shares follow the weights; unknown or all-zero splits are rejected.
+    """
+    registry = _registry("a", "b", "c")
+    registry.set_routes({"a": 3, "b": 1, "c": 0})
+    shares = {name: metrics['traffic_share'] for name, metrics in registry.metrics().items()}
+    assert np.isclose(shares["a"], 0.75) and np.isclose(shares["b"], 0.25) and shares["c"] == 0.0
+    assert registry.routes[-1][1] == 1.0
+
+    for weights in ({"missing": 1}, {"a": 0}, {}):
+        try:
+            registry.set_routes(weights)
+        except ValueError:
+            continue
+        raise AssertionError(f"{weights!r} should be rejected")
+    # A rejected split leaves the previous one in place
+    assert [version.name for version, _ in registry.routes] == ["a", "b"]
+
+    try:
+        registry.unload("a")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("a version receiving traffic must not be unloaded")
+    registry.unload("c")
+    assert "c" not in registry.versions
+
+def test_route():
+    """
+    Users are routed deterministically and in proportion to the weights.
+    """
+    registry = _registry("a", "b")
+    registry.set_routes({"a": 9, "b": 1})
+    assignments = [registry.route(f"user-{i}").name for i in range(20000)]
+    assert [registry.route(f"user-{i}").name for i in range(100)] == assignments[:100]
+    assert abs(assignments.count("b") / len(assignments) - 0.1) < 0.01
+
+    # Growing b's share only moves users from a to b, never the other way
+    registry.set_routes({"a": 1, "b": 1})
+    moved = [registry.route(f"user-{i}").name for i in range(20000)]
+    assert all(new == "b" for old, new in zip(assignments, moved) if old == "b")
+
+    registry.promote("b")
+    assert {registry.route(f"user-{i}").name for i in range(1000)} == {"b"}
+    try:
+        ModelRegistry().route("user")
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("routing without versions should fail")
+
+def _record_in_child(registry: ModelRegistry):
+    registry.after_fork()
+    registry.record(registry.versions["a"], 0.1)
+
+def test_after_fork():
+    """
+    A version lock held while forking does not block the forked process.
+    """
+    import multiprocessing
+
+    registry = _registry("a")
+    registry.set_routes({"a": 1})
+    with registry.versions["a"]._lock:
+        child = multiprocessing.get_context('fork').Process(target=_record_in_child, args=(registry,))
+        child.start()
+    child.join(timeout=5)
+    if child.exitcode is None:
+        child.kill()
+    assert child.exitcode == 0
+
+def _filter_movies() -> pd.DataFrame:
+    """
+    Build a small preprocessed catalog spanning more than one bitset byte.
+    """
+    movies = pd.DataFrame({
+        'movieId': range(1, 12),
+        'title': [
+            "Alpha (1990)", "Beta (1995)", "Gamma (1995)", "Delta (2000)", "Epsilon",
+            "Zeta (2005)", "Eta (1987)", "Theta (2010)", "Iota (2010)", "Kappa (1999)",
+            "Lambda (2021)",
+        ],
+        'genres': [
+            "Action|Comedy", "Drama", "Comedy", "Action|Sci-Fi", "Drama|Comedy",
+            "Sci-Fi", "Action", "Comedy|Drama", "Sci-Fi|Action", "Drama",
+            "Comedy|Sci-Fi",
+        ],
+    })
+    return DataHandler("data/").preprocess_movies(movies)
+
+def _expected_mask(movies, genres=None, exclude_genres=None, year_range=None, rating_counts=None, min_ratings=None):
+    """
+    Apply the filters row by row, as a reference for FilterIndex.compile_mask.
+    """
+    years = movies['title'].str.extract(r'\((\d{4})\)')[0].astype(float)
+    expected = []
+    for row, (movie_genres, year) in enumerate(zip(movies['genres'], years)):
+        keep = not genres or any(genre in movie_genres for genre in genres)
+        keep &= not any(genre in movie_genres for genre in exclude_genres or ())
+        if year_range is not None:
+            first, last = year_range
+            keep &= not np.isnan(year) and (first is None or year >= first) and (last is None or year <= last)
+        if min_ratings:
+            keep &= rating_counts[row] >= min_ratings
+        expected.append(bool(keep))
+    return np.array(expected)
+
+def test_filter_index():
+    """
+    Compiled masks match a row-by-row filter, including year-range edges.
+    """
+    movies = _filter_movies()
+    rating_counts = np.arange(len(movies)) * 3
+    index = FilterIndex(movies, rating_counts=rating_counts)
+    assert index.compile_mask() is None
+
+    cases = [
+        {'genres': ['Comedy']},
+        {'genres': ['Sci-Fi', 'Drama']},
+        {'exclude_genres': ['Action']},
+        {'genres': ['Comedy'], 'exclude_genres': ['Drama', 'Sci-Fi']},
+        {'year_range': (1995, 2005)},      # inclusive bounds, repeated years
+        {'year_range': (None, 1995)},
+        {'year_range': (2010, None)},
+        {'year_range': (1996, 1998)},      # no movie in range
+        {'year_range': (2030, 1900)},      # reversed range
+        {'year_range': (None, None)},      # any known year, drops "Epsilon"
+        {'min_ratings': 10},
+        {'genres': ['Action'], 'year_range': (1988, None), 'min_ratings': 3},
+    ]
+    for filters in cases:
+        mask = index.compile_mask(**filters)
+        expected = _expected_mask(movies, rating_counts=rating_counts, **filters)
+        assert mask.dtype == bool and len(mask) == len(movies), filters
+        assert (mask == expected).all(), (filters, mask, expected)
+
+def test_filter_index_errors():
+    """
+    Unknown genres and min_ratings without rating counts are rejected.
+    """
+    index = FilterIndex(_filter_movies())
+    for filters in ({'genres': ['sci-fi']}, {'exclude_genres': ['Horror']}, {'min_ratings': 5}):
+        try:
+            index.compile_mask(**filters)
+        except ValueError:
+            continue
+        raise AssertionError(f"{filters!r} should be rejected")
+
+_synthetic = None
+
+def _synthetic_model() -> HybridModel:
+    """
+    Build (once) a small HybridModel from random ratings.
+
+    The catalog has 40 movies, 3 of which nobody rated, and skewed popularity.
+    The model is built in a temporary directory so that its similarity tables
+    do not overwrite real ones in the working directory.
+    """
+    global _synthetic
+    if _synthetic is None:
+        rng = np.random.default_rng(0)
+        genre_names = ["Action", "Comedy", "Drama", "Sci-Fi", "Horror"]
+        movies = pd.DataFrame({
+            'movieId': np.arange(40) * 10 + 1,
+            'title': [f"Movie {i} ({1980 + i})" for i in range(40)],
+            'genres': ["|".join(genre_names[j] for j in range(5) if (i * 7 + 3) >> j & 1) or "Drama" for i in range(40)],
+        })
+        movies = DataHandler("data/").preprocess_movies(movies)
+
+        rated_ids = movies['movieId'].to_numpy()[:37]
+        popularity = np.linspace(3, 0.2, len(rated_ids))
+        ratings = []
+        for user in range(60):
+            for movie_id in rng.choice(rated_ids, 10, replace=False, p=popularity / popularity.sum()):
+                ratings.append((user, movie_id, rng.integers(1, 11) / 2))
+        ratings = pd.DataFrame(ratings, columns=['userId', 'movieId', 'rating'])
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                _synthetic = HybridModel(movies, ratings).warm_up()
+            finally:
+                os.chdir(cwd)
+    return _synthetic
+
+def _history(model: HybridModel):
+    """
+    Return a rating history that includes the most popular movies, and its catalog rows.
+    """
+    rows = np.concatenate([model._lookups()['popular_rows'][:8], [20, 30, 38]])
+    ratings = np.array([5, 4, 1, 4.5, 2, 5, 3, 4, 5, 1, 4], dtype=float)
+    return model.movies['movieId'].to_numpy()[rows], ratings, rows
+
+def _profile_weights(model: HybridModel, profile, movie_ids) -> np.ndarray:
+    """
+    Return the profile weight of each movie ID.
+    """
+    return profile.toarray()[0, model._lookups()['row_of_movie'][movie_ids].to_numpy()]
+
+def test_build_profile():
+    """
+    Ratings are mean-centered unless all equal, decayed by age, and unknown IDs dropped.
+    """
+    model = _synthetic_model()
+    movie_ids = model.movies['movieId'].to_numpy()[[3, 0, 17, 39]]
+
+    profile = model.build_profile(movie_ids, [5, 3, 4, 2])
+    assert profile.shape == (1, len(model.movies))
+    assert np.allclose(_profile_weights(model, profile, movie_ids), [1.5, -0.5, 0.5, -1.5])
+
+    # Average ratings center to 0 and are dropped; equal ratings are not centered
+    assert model.build_profile(movie_ids[:3], [5, 3, 4]).nnz == 2
+    assert np.allclose(_profile_weights(model, model.build_profile(movie_ids, [4, 4, 4, 4]), movie_ids), 4)
+    assert np.allclose(_profile_weights(model, model.build_profile(movie_ids, [5, 3, 4, 2], center=False), movie_ids),
+                       [5, 3, 4, 2])
+
+    # Each half-life of age halves a weight, relative to the most recent rating
+    day = 86400
+    profile = model.build_profile(movie_ids, [4, 4, 4, 4], timestamps=[30 * day, 20 * day, 10 * day, 0],
+                                  half_life_days=10)
+    assert np.allclose(_profile_weights(model, profile, movie_ids), [4, 2, 1, 0.5])
+    assert model.build_profile(movie_ids, [4, 4, 4, 4], timestamps=[30 * day, 20 * day, 10 * day, 0]).data.tolist() == [4] * 4
+
+    # Unknown IDs do not shift the mean or the most recent timestamp
+    profile = model.build_profile(np.append(movie_ids, [5, 99999]), [5, 3, 4, 2, 1, 1],
+                                  timestamps=[30 * day, 20 * day, 10 * day, 0, 90 * day, 90 * day], half_life_days=10)
+    assert profile.nnz == 4
+    assert np.allclose(_profile_weights(model, profile, movie_ids), [1.5, -0.25, 0.125, -0.1875])
+    assert model.build_profile([99999], [5]).nnz == 0
+
+def test_generate_candidates():
+    """
+    Rated and filtered rows are dropped from each source before its cap.
+    """
+    model = _synthetic_model()
+    movie_ids, ratings, rated_rows = _history(model)
+    profile = model.build_profile(movie_ids, ratings)
+    collab_rows, collab_scores = model._collaborative_row_scores(profile)
+    limits = {'collaborative': 5, 'content': 5, 'popular': 5}
+
+    for mask in (None, model.filter_mask(exclude_genres=["Horror"])):
+        keep = np.ones(len(model.movies), dtype=bool) if mask is None else mask.copy()
+        keep[rated_rows] = False
+        candidates = model.generate_candidates(profile, (collab_rows, collab_scores), rated_rows, limits, mask=mask)
+        assert len(set(candidates)) == len(candidates) and keep[candidates].all()
+
+        # Each source still contributes its full cap of eligible rows
+        popular = [row for row in model._lookups()['popular_rows'] if keep[row]][:5]
+        assert set(popular) <= set(candidates)
+
+        eligible = keep[collab_rows]
+        scores = collab_scores[eligible]
+        threshold = np.sort(scores)[-5]
+        assert np.count_nonzero(np.isin(collab_rows[eligible], candidates)) >= 5
+        assert set(collab_rows[eligible][scores > threshold]) <= set(candidates)
+
+        liked = profile.data > 0
+        seeds = profile.indices[liked][np.argsort(-profile.data[liked])]
+        content = model._content().nearest_neighbors(seeds, 5, keep)
+        assert len(content) == 5 and set(content) <= set(candidates)
+
+    assert np.array_equal(
+        model.generate_candidates(profile, (collab_rows, collab_scores), rated_rows, exhaustive=True),
+        np.setdiff1d(np.arange(len(model.movies)), rated_rows),
+    )
+
+def test_recommend_profile_exhaustive():
+    """
+    The exhaustive ranking matches blending full content and collaborative scores.
+    """
+    model = _synthetic_model()
+    movie_ids, ratings, rated_rows = _history(model)
+    profile = model.build_profile(movie_ids, ratings)
+
+    expected = 0.4 * model.content_scores(profile) + 0.6 * model.collaborative_scores(profile)
+    expected[rated_rows] = -np.inf
+    recommendations = model.recommend_profile(profile, rated_rows, top_n=10, exhaustive=True)
+
+    rows = model._lookups()['row_of_movie'][recommendations['movieId']].to_numpy()
+    assert list(recommendations.columns) == ['movieId', 'title', 'genres']
+    assert len(set(rows)) == 10 and not np.isin(rows, rated_rows).any()
+    assert np.allclose(expected[rows], np.sort(expected)[::-1][:10])
+
+    empty = model.recommend_profile(model.build_profile([], []))
+    assert empty.empty and list(empty.columns) == ['movieId', 'title', 'genres']
+
+def test_recommend_filters():
+    """
+    Recommendations pass the filters, with and without candidate generation.
+    """
+    model = _synthetic_model()
+    movie_ids, ratings, rated_rows = _history(model)
+    filters = {'genres': ["Comedy", "Drama"], 'exclude_genres': ["Action"], 'year_range': (1990, 2015)}
+    expected = _expected_mask(model.movies, **filters)
+    expected[rated_rows] = False
+
+    for exhaustive in (False, True):
+        recommendations = model.recommend_from_history(movie_ids, ratings, top_n=50, exhaustive=exhaustive, **filters)
+        rows = model._lookups()['row_of_movie'][recommendations['movieId']].to_numpy()
+        assert len(rows) and expected[rows].all(), (exhaustive, rows)
+        if exhaustive:
+            assert len(rows) == np.count_nonzero(expected)
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
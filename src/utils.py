@@ -1,10 +1,27 @@
 import pandas as pd
 import numpy as np
 import os
+import json
 import difflib
 from pathlib import Path
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+
+def _replace_file(path: str, write):
+    """
+    Rewrite `path` by calling `write` on a temporary file and renaming it over.
+
+    The saved similarity and neighbor tables are memory-mapped by other models
+    and processes; truncating them in place would crash those with SIGBUS.
+    After the rename, existing mappings keep reading the old file.
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
 
 class DataHandler:
     """
@@ -27,13 +44,21 @@ class DataHandler:
         This method reads the specified CSV files from the data directory
         and returns them as pandas DataFrames.
         """
-        movies_path = self.data_path / movies_file
         ratings_path = self.data_path / ratings_file
 
-        movies = pd.read_csv(movies_path)
+        movies = self.load_movies(movies_file)
         ratings = pd.read_csv(ratings_path)
         return movies, ratings
 
+    def load_movies(self, movies_file: str) -> pd.DataFrame:
+        """
+        Load only the movie metadata CSV file.
+
+        Serving code never touches the ratings, so this avoids reading
+        the (much larger) ratings file just to throw it away.
+        """
+        return pd.read_csv(self.data_path / movies_file)
+
     def preprocess_movies(self, movies: pd.DataFrame) -> pd.DataFrame:
         """
         Preprocess movie data by splitting genres and creating genre flags.
@@ -53,6 +78,84 @@ class DataHandler:
 
         return movies
 
+class FilterIndex:
+    """
+    A metadata index for filtering movies without scanning the DataFrame.
+
+    Built once when movies are loaded, it holds one packed bitset per genre
+    (from the genre flag columns added by `DataHandler.preprocess_movies`),
+    the release years in sorted order for range lookups, and optionally the
+    number of ratings of every movie. Filters compile to a single boolean mask
+    over movie positions using only bitwise operations on these arrays.
+    """
+
+    def __init__(self, movies: pd.DataFrame, rating_counts: np.ndarray | None = None):
+        """
+        Build the index from preprocessed movies.
+
+        `rating_counts`, if given, holds the number of ratings of each movie,
+        aligned with the rows of `movies`.
+        """
+        self.n_movies = len(movies)
+        self.genres = sorted(set(
+            genre for sublist in movies['genres'] if isinstance(sublist, list) for genre in sublist
+        ))
+        self.genre_bits = {
+            genre: np.packbits(movies[genre].to_numpy(dtype=bool)) for genre in self.genres
+        }
+
+        # Release year from titles like "Toy Story (1995)"; unknown years sort last as NaN
+        years = pd.to_numeric(movies['title'].str.extract(r'\((\d{4})\)')[0], errors='coerce').to_numpy()
+        self.years = years
+        self.year_order = np.argsort(years, kind='stable')
+        self.sorted_years = years[self.year_order][:np.count_nonzero(~np.isnan(years))]
+
+        self.rating_counts = rating_counts
+
+    def compile_mask(self, genres=None, exclude_genres=None, year_range=None, min_ratings=None):
+        """
+        Compile filters into one boolean mask over movie positions.
+
+        `genres` keeps movies with at least one of the listed genres,
+        `exclude_genres` drops movies with any of them, `year_range` is an
+        inclusive (first, last) release-year range where either bound may be
+        None (movies without a year never match), and `min_ratings` requires
+        that many ratings. Returns None when no filter is set, so callers can
+        skip filtering entirely. Raises ValueError for genres not in
+        `self.genres`, so a misspelled genre is not silently ignored.
+        """
+        if not genres and not exclude_genres and year_range is None and not min_ratings:
+            return None
+
+        unknown = sorted(set(genres or ()).union(exclude_genres or ()).difference(self.genres))
+        if unknown:
+            raise ValueError(f"Unknown genres {unknown}, expected any of {self.genres}")
+
+        empty = np.zeros((self.n_movies + 7) // 8, dtype=np.uint8)
+        bits = ~empty
+        if genres:
+            included = empty.copy()
+            for genre in genres:
+                included |= self.genre_bits[genre]
+            bits &= included
+        for genre in exclude_genres or ():
+            bits &= ~self.genre_bits[genre]
+
+        if year_range is not None:
+            first, last = year_range
+            start = 0 if first is None else np.searchsorted(self.sorted_years, first, side='left')
+            stop = len(self.sorted_years) if last is None else np.searchsorted(self.sorted_years, last, side='right')
+            in_range = np.zeros(self.n_movies, dtype=bool)
+            in_range[self.year_order[start:stop]] = True
+            bits &= np.packbits(in_range)
+
+        if min_ratings:
+            if self.rating_counts is None:
+                raise ValueError("min_ratings needs an index built with rating counts")
+            bits &= np.packbits(self.rating_counts >= min_ratings)
+
+        return np.unpackbits(bits, count=self.n_movies).astype(bool)
+
 class ContentModel:
     """
     A content-based recommendation model using TF-IDF and cosine similarity.
@@ -62,6 +165,9 @@ class ContentModel:
     to find movies similar to those rated by users.
     """
     
+    # Number of precomputed content neighbors kept per movie for candidate generation
+    NEIGHBORS_PER_MOVIE = 50
+
     def __init__(self, movies: pd.DataFrame):
         """
         Initialize the ContentModel with movie data.
@@ -69,6 +175,10 @@ class ContentModel:
         This constructor sets up the TF-IDF vectorizer, computes the similarity matrix,
         and creates necessary mappings for efficient recommendation generation.
         """
+        # scikit-learn is only needed here, keep it off the import path
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.metrics.pairwise import cosine_similarity
+
         self.movies = movies
         self.tfidf = TfidfVectorizer(stop_words='english')
 
@@ -76,15 +186,24 @@ class ContentModel:
         genre_strings = movies['genres'].apply(lambda x: ' '.join(x) if isinstance(x, list) else str(x))
         self.tfidf_matrix = self.tfidf.fit_transform(genre_strings)
 
-        # Precompute cosine similarity matrix if not exists
+        # Precompute cosine similarity matrix if not exists. The saved matrix is
+        # memory-mapped read-only so that processes share it through the page cache.
         if os.path.exists("cosine_sim.npy"):
-            self.cosine_sim = np.load("cosine_sim.npy")
-        else:
+            self.cosine_sim = np.load("cosine_sim.npy", mmap_mode='r')
+        if not os.path.exists("cosine_sim.npy") or self.cosine_sim.shape != (len(movies), len(movies)):
+            if os.path.exists("cosine_sim.npy"):
+                print("Rebuilding cosine_sim.npy, it does not match the current movies")
             self.cosine_sim = cosine_similarity(self.tfidf_matrix, self.tfidf_matrix)
-            np.save("cosine_sim.npy", self.cosine_sim)
+            _replace_file("cosine_sim.npy", lambda f: np.save(f, self.cosine_sim))
 
-        # Create title to index mapping
-        self.indices = pd.Series(movies.index, index=movies['title']).drop_duplicates()
+        # Genre/year bitsets and content neighbor table, built on first use by
+        # filter_mask() and neighbors()
+        self._filter_index = None
+        self._neighbors = None
+
+        # Create title to index mapping (first movie wins for duplicate titles)
+        indices = pd.Series(movies.index, index=movies['title'])
+        self.indices = indices[~indices.index.duplicated()]
 
     def find_closest_title(self, input_title: str) -> str | None:
         """
@@ -97,7 +216,109 @@ class ContentModel:
         matches = difflib.get_close_matches(input_title, titles, n=1, cutoff=0.6)
         return matches[0] if matches else None
 
-    def content_recommendations(self, user_ratings: dict, top_n=10) -> pd.DataFrame:
+    def profile_scores(self, movie_indices: np.ndarray, weights: np.ndarray, candidates=None) -> np.ndarray:
+        """
+        Score movies against a weighted set of rated movies.
+
+        Computes the weighted average of the similarity rows of the rated movies
+        in a single matrix product. Negative weights (e.g. mean-centered dislikes)
+        push similar movies down. If `candidates` is given, only those movies
+        are scored (in that order), and only their similarity entries are read.
+        """
+        n_scored = len(self.movies) if candidates is None else len(candidates)
+        total_weight = np.abs(weights).sum()
+        if len(movie_indices) == 0 or total_weight == 0:
+            return np.zeros(n_scored)
+        if candidates is None:
+            similarities = self.cosine_sim[movie_indices]
+        else:
+            similarities = self.cosine_sim[np.ix_(movie_indices, candidates)]
+        return (weights @ similarities) / total_weight
+
+    def _neighbors_key(self) -> dict:
+        """
+        Describe what the content neighbor table is computed from.
+
+        Saved next to the table so that a table built for another catalog,
+        neighbor count or similarity matrix is detected and rebuilt.
+        """
+        n_movies = len(self.movies)
+        return {
+            'n_movies': n_movies,
+            'n_neighbors': min(self.NEIGHBORS_PER_MOVIE, n_movies - 1),
+            'cosine_sim_mtime': os.path.getmtime("cosine_sim.npy") if os.path.exists("cosine_sim.npy") else None,
+        }
+
+    def neighbors(self) -> np.ndarray:
+        """
+        Return the most similar movies of every movie, most similar first.
+
+        The (n_movies, NEIGHBORS_PER_MOVIE) table is computed from the cosine
+        similarity matrix on first use, saved next to it and memory-mapped on
+        later loads, like the similarity matrix itself. A saved table that does
+        not match the current catalog, neighbor count or similarity matrix
+        (see `content_neighbors.json`) is rebuilt.
+        """
+        if self._neighbors is None:
+            key = self._neighbors_key()
+            saved_key = None
+            if os.path.exists("content_neighbors.npy") and os.path.exists("content_neighbors.json"):
+                with open("content_neighbors.json") as f:
+                    saved_key = json.load(f)
+
+            if saved_key == key:
+                self._neighbors = np.load("content_neighbors.npy", mmap_mode='r')
+            else:
+                if os.path.exists("content_neighbors.npy"):
+                    print("Rebuilding content_neighbors.npy, it does not match the current movies")
+                n_movies, n_neighbors = key['n_movies'], key['n_neighbors']
+                neighbors = np.empty((n_movies, n_neighbors), dtype=np.int32)
+                # Process the similarity matrix in row blocks to bound memory
+                for start in range(0, n_movies, 1024):
+                    block = np.array(self.cosine_sim[start:start + 1024])
+                    rows = np.arange(len(block))
+                    block[rows, rows + start] = -np.inf  # a movie is not its own neighbor
+                    top = np.argpartition(-block, n_neighbors - 1, axis=1)[:, :n_neighbors]
+                    order = np.argsort(-np.take_along_axis(block, top, axis=1), axis=1)
+                    neighbors[start:start + len(block)] = np.take_along_axis(top, order, axis=1)
+                _replace_file("content_neighbors.npy", lambda f: np.save(f, neighbors))
+                _replace_file("content_neighbors.json", lambda f: f.write(json.dumps(key).encode()))
+                self._neighbors = neighbors
+        return self._neighbors
+
+    def filter_mask(self, genres=None, exclude_genres=None, year_range=None):
+        """
+        Compile recommendation filters into a boolean mask over movies.
+
+        The `FilterIndex` is built on the first filtered request, so models
+        that are never asked to filter (like the one inside `HybridModel`,
+        which has its own index) do not build one. Returns None when no filter
+        is set; see `FilterIndex.compile_mask`.
+        """
+        if not genres and not exclude_genres and year_range is None:
+            return None
+        if self._filter_index is None:
+            self._filter_index = FilterIndex(self.movies)
+        return self._filter_index.compile_mask(genres, exclude_genres, year_range)
+
+    def nearest_neighbors(self, movie_indices: np.ndarray, n: int, mask=None) -> np.ndarray:
+        """
+        Return up to `n` distinct movies most similar to the given movies.
+
+        Candidates are taken rank by rank across all given movies (every movie's
+        closest neighbor first, then every second closest, ...), with earlier
+        movies in `movie_indices` winning ties. If a boolean `mask` over movies
+        is given, neighbors failing it are skipped before the limit is applied.
+        """
+        if len(movie_indices) == 0 or n <= 0:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.asarray(self.neighbors()[movie_indices]).ravel(order='F')
+        if mask is not None:
+            candidates = candidates[mask[candidates]]
+        return pd.unique(candidates)[:n].astype(np.int64)
+
+    def content_recommendations(self, user_ratings: dict, top_n=10, genres=None,
+                                exclude_genres=None, year_range=None) -> pd.DataFrame:
         """
         Generate content-based movie recommendations using user ratings.
 
@@ -105,7 +326,8 @@ class ContentModel:
         1. Matches user-provided movie titles to dataset titles using fuzzy matching
         2. Calculates weighted similarity scores based on user ratings
         3. Recommends movies most similar to highly-rated movies
-        4. Filters out movies the user has already rated
+        4. Filters out movies the user has already rated, and movies failing the
+           optional genre and year filters (see `FilterIndex.compile_mask`)
         """
         print(f"Debug: Input ratings: {user_ratings}")
 
@@ -124,22 +346,18 @@ class ContentModel:
             return pd.DataFrame(columns=['title', 'genres'])
 
         # Calculate weighted similarity scores
-        sim_scores = np.zeros(len(self.movies))
-        total_weight = 0
-
-        for movie_title, rating in matched_movies.items():
-            if movie_title in self.indices:
-                movie_idx = self.indices[movie_title]
-                # Get similarity scores for this movie
-                movie_similarities = self.cosine_sim[movie_idx]
-                # Weight by user rating
-                sim_scores += movie_similarities * rating
-                total_weight += rating
-                print(f"Debug: Added similarities for '{movie_title}' with weight {rating}")
-
-        # Normalize by total weight
-        if total_weight > 0:
-            sim_scores = sim_scores / total_weight
+        rated = [title for title in matched_movies if title in self.indices]
+        sim_scores = self.profile_scores(
+            self.indices[rated].to_numpy(),
+            np.array([matched_movies[title] for title in rated], dtype='float32'),
+        )
+        for movie_title in rated:
+            print(f"Debug: Added similarities for '{movie_title}' with weight {matched_movies[movie_title]}")
+
+        # Drop movies failing the filters before ranking
+        mask = self.filter_mask(genres, exclude_genres, year_range)
+        if mask is not None:
+            sim_scores = np.where(mask, sim_scores, -np.inf)
 
         # Get movie indices sorted by similarity
         sim_scores_indexed = list(enumerate(sim_scores))
@@ -148,6 +366,8 @@ class ContentModel:
         # Filter out movies the user already rated and get top N
         recommendations = []
         for movie_idx, score in sim_scores_indexed:
+            if len(recommendations) >= top_n or score == -np.inf:
+                break
             movie_title = self.movies.iloc[movie_idx]['title']
             if movie_title not in matched_movies and len(recommendations) < top_n:
                 recommendations.append(movie_idx)
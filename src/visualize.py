@@ -1,26 +1,149 @@
-import matplotlib.pyplot as plt
-import seaborn as sns
 import pandas as pd
 import os
 from utils import DataHandler
 
-# Load data
-data_handler = DataHandler("data/")
-movies, ratings = data_handler.load_data("movies.csv", "ratings.csv")
-movies = data_handler.preprocess_movies(movies)
+# matplotlib and seaborn are imported inside the plotting methods, and the data
+# is only loaded by load_visualization_data(), so importing this module is cheap.
 vis_dir = "visualizations"
 
-# Check if visualizations directory exists, if not create one
-if not os.path.exists(vis_dir):
-    os.mkdir(vis_dir)
+class RatingAggregates:
+    """
+    Aggregate rating statistics computed in a single streaming pass.
 
-# Merge movies and ratings
-df = pd.merge(movies, ratings, on='movieId')
+    The ratings file is read in chunks and reduced to per-movie sums and counts,
+    per-year sums and counts, and a histogram of rating values. Only these small
+    aggregates are ever joined to the movie metadata, so the full ratings table
+    never has to be held in memory (let alone merged with the movies).
+    """
+
+    def __init__(self):
+        """
+        Initialize empty aggregates.
+        """
+        self.movie_sum = pd.Series(dtype='float64')
+        self.movie_count = pd.Series(dtype='int64')
+        self.year_sum = pd.Series(dtype='float64')
+        self.year_count = pd.Series(dtype='int64')
+        self.rating_hist = pd.Series(dtype='int64')
+
+    def update(self, chunk: pd.DataFrame):
+        """
+        Fold one chunk of ratings into the running aggregates.
+        """
+        by_movie = chunk.groupby('movieId')['rating']
+        self.movie_sum = self.movie_sum.add(by_movie.sum(), fill_value=0)
+        self.movie_count = self.movie_count.add(by_movie.count(), fill_value=0).astype('int64')
+
+        year = pd.to_datetime(chunk['timestamp'], unit='s').dt.year
+        by_year = chunk['rating'].groupby(year)
+        self.year_sum = self.year_sum.add(by_year.sum(), fill_value=0)
+        self.year_count = self.year_count.add(by_year.count(), fill_value=0).astype('int64')
+
+        counts = chunk['rating'].value_counts()
+        self.rating_hist = self.rating_hist.add(counts, fill_value=0).astype('int64')
+
+    def movie_stats(self, movies: pd.DataFrame) -> pd.DataFrame:
+        """
+        Join the per-movie aggregates to the movie titles.
+
+        Returns one row per title with its average rating and rating count.
+        Movies sharing a title are combined, as grouping the merged table by
+        title would.
+        """
+        stats = pd.DataFrame({'rating_sum': self.movie_sum, 'rating_count': self.movie_count})
+        stats = movies[['movieId', 'title']].join(stats, on='movieId', how='inner')
+        stats = stats.groupby('title')[['rating_sum', 'rating_count']].sum().reset_index()
+        stats['avg_rating'] = stats['rating_sum'] / stats['rating_count']
+        return stats[['title', 'avg_rating', 'rating_count']]
+
+    def yearly_means(self) -> pd.Series:
+        """
+        Return the average rating for each year, indexed by year.
+        """
+        return (self.year_sum / self.year_count).sort_index()
+
+    def to_dict(self) -> dict:
+        """
+        Return the aggregates as a plain dict of Series, suitable for caching.
+        """
+        return {name: getattr(self, name) for name in
+                ('movie_sum', 'movie_count', 'year_sum', 'year_count', 'rating_hist')}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RatingAggregates":
+        """
+        Rebuild aggregates from the output of `to_dict`.
+        """
+        aggregates = cls()
+        for name, value in data.items():
+            setattr(aggregates, name, value)
+        return aggregates
+
+    @classmethod
+    def from_csv(cls, ratings_path, chunksize: int = 1_000_000) -> "RatingAggregates":
+        """
+        Compute the aggregates by streaming the ratings CSV in chunks.
+
+        Only the columns the plots need are read, so peak memory is bounded by
+        the chunk size rather than the size of the ratings file.
+        """
+        aggregates = cls()
+        reader = pd.read_csv(
+            ratings_path,
+            usecols=['movieId', 'rating', 'timestamp'],
+            dtype={'movieId': 'int32', 'rating': 'float32', 'timestamp': 'int64'},
+            chunksize=chunksize,
+        )
+        for chunk in reader:
+            aggregates.update(chunk)
+        return aggregates
+
+def load_rating_aggregates(data_handler: DataHandler, ratings_file: str = "ratings.csv",
+                           cache_file: str = "rating_aggregates.pkl") -> RatingAggregates:
+    """
+    Load the rating aggregates, computing and caching them if needed.
+
+    The cache lives next to the ratings file and is invalidated whenever the
+    ratings file's size or modification time changes, so regenerating the plots
+    does not touch the ratings at all.
+    """
+    ratings_path = data_handler.data_path / ratings_file
+    cache_path = data_handler.data_path / cache_file
+    stat = os.stat(ratings_path)
+    source = (stat.st_size, stat.st_mtime_ns)
+
+    if cache_path.exists():
+        cached = pd.read_pickle(cache_path)
+        if cached.get('source') == source:
+            return RatingAggregates.from_dict(cached['aggregates'])
+
+    aggregates = RatingAggregates.from_csv(ratings_path)
+    pd.to_pickle({'source': source, 'aggregates': aggregates.to_dict()}, cache_path)
+    return aggregates
+
+def load_visualization_data(data_path: str = "data/"):
+    """
+    Load the movie data and rating aggregates used by the plots.
+
+    Returns the preprocessed movies and their `RatingAggregates`, and makes sure
+    the visualizations directory exists.
+    """
+    data_handler = DataHandler(data_path)
+    movies = data_handler.preprocess_movies(data_handler.load_movies("movies.csv"))
+    aggregates = load_rating_aggregates(data_handler)
+
+    # Check if visualizations directory exists, if not create one
+    if not os.path.exists(vis_dir):
+        os.mkdir(vis_dir)
+
+    return movies, aggregates
 
 class Visualizer:
     @staticmethod
     def plot_genre_distribution(movies: pd.DataFrame):
         """Plot distribution of movie genres"""
+        import matplotlib.pyplot as plt
+
         # Get all unique genres
         all_genres = set()
         for genres_list in movies['genres']:
@@ -46,10 +169,13 @@ class Visualizer:
         plt.show()
     
     @staticmethod
-    def plot_rating_distribution(ratings: pd.DataFrame):
-        """Plot distribution of ratings"""
+    def plot_rating_distribution(rating_hist: pd.Series):
+        """Plot distribution of ratings from a histogram of rating values"""
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
         plt.figure(figsize=(10, 6))
-        sns.histplot(ratings['rating'], bins=10, kde=True)
+        sns.histplot(x=rating_hist.index, weights=rating_hist.values, bins=10, kde=True)
         plt.title('Rating Distribution')
         plt.xlabel('Rating')
         plt.ylabel('Frequency')
@@ -60,6 +186,8 @@ class Visualizer:
     @staticmethod
     def plot_movies_per_year(movies: pd.DataFrame):
         """Plot number of movies released per year"""
+        import matplotlib.pyplot as plt
+
         # Extract year from title (assuming format like "Movie Title (Year)")
         movies['year'] = movies['title'].str.extract(r'\((\d{4})\)')
         movies['year'] = pd.to_numeric(movies['year'], errors='coerce')
@@ -80,16 +208,10 @@ class Visualizer:
         plt.show()
     
     @staticmethod
-    def plot_top_rated_movies(df: pd.DataFrame, min_ratings=50):
+    def plot_top_rated_movies(movie_stats: pd.DataFrame, min_ratings=50):
         """Plot top rated movies with minimum number of ratings"""
-        # Calculate average rating and count for each movie
-        movie_stats = df.groupby('title').agg({
-            'rating': ['mean', 'count']
-        }).reset_index()
-        
-        # Flatten column names
-        movie_stats.columns = ['title', 'avg_rating', 'rating_count']
-        
+        import matplotlib.pyplot as plt
+
         # Filter movies with minimum ratings
         popular_movies = movie_stats[movie_stats['rating_count'] >= min_ratings]
         top_movies = popular_movies.nlargest(15, 'avg_rating')
@@ -103,15 +225,10 @@ class Visualizer:
         plt.show()
     
     @staticmethod
-    def plot_rating_trends(df: pd.DataFrame):
-        """Plot rating trends over time"""
-        # Convert timestamp to datetime
-        df['datetime'] = pd.to_datetime(df['timestamp'], unit='s')
-        df['year'] = df['datetime'].dt.year
-        
-        # Calculate average rating per year
-        yearly_ratings = df.groupby('year')['rating'].mean()
-        
+    def plot_rating_trends(yearly_ratings: pd.Series):
+        """Plot average rating per year"""
+        import matplotlib.pyplot as plt
+
         plt.figure(figsize=(12, 6))
         plt.plot(yearly_ratings.index, yearly_ratings.values, marker='o', linewidth=2)
         plt.title('Average Rating Trends Over Time')
@@ -125,6 +242,7 @@ class Visualizer:
 def create_all_visualizations():
     """Create all visualizations"""
     print("Creating visualizations...")
+    movies, aggregates = load_visualization_data()
     
     viz = Visualizer()
     
@@ -132,16 +250,16 @@ def create_all_visualizations():
     viz.plot_genre_distribution(movies)
     
     print("2. Rating distribution...")
-    viz.plot_rating_distribution(ratings)
+    viz.plot_rating_distribution(aggregates.rating_hist)
     
     print("3. Movies per year...")
     viz.plot_movies_per_year(movies)
     
     print("4. Top rated movies...")
-    viz.plot_top_rated_movies(df)
+    viz.plot_top_rated_movies(aggregates.movie_stats(movies))
     
     print("5. Rating trends...")
-    viz.plot_rating_trends(df)
+    viz.plot_rating_trends(aggregates.yearly_means())
     
     print("All visualizations saved!")
 